@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+'''Benchmark: memory and setup time per geneNS.
+Compares geneNS as it is now, on the slotted nsdict with reserved names
+held once per class as a frozenset, against the same gene namespace on
+the original nsdict, which listed dir(self) into every instance's
+__dict__ and searched that list for each key set. Run from the
+repository root:
+    python3 benchmarks/gene_namespace_memory.py [number of genes]
+'''
+import keyword
+import os
+import sys
+import timeit
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dnamespace import genomespace
+
+class baseline_nsdict(object):
+    '''The original virtualns.nsdict, kept here for comparison. Only
+    docstrings and some comments are left out.'''
+    def __init__(self, somedict=None, autofix=False):
+        self._autofix = bool(autofix)
+        # Need a list of methods so we can rename keys that conflict.
+        # Keep this call second last in __init__, right before dict import.
+        self._method_keywords = dir(self)
+        self._method_keywords.append("_method_keywords")
+        if somedict:
+            self._update(somedict)
+
+    def __test_conflict__(self, key):
+        'Tests a new key for conflict with reserved keywords or required object methods/attributes.'
+        return (key in keyword.kwlist) or (key in self._method_keywords)
+
+    def __setitem__(self, key, value):
+        'Set properties for all new dict keys. Reserved words are suffixed with "_".'
+        if self.__test_conflict__(key):
+            if self._autofix:
+                while self.__test_conflict__(key):
+                    key = key+"_"
+            else:
+                raise KeyError(("Key to be set conflicts with a reserved "
+                    "keywords or required object attribute."))
+        self.__dict__[key] = value
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __delitem__(self, key):
+        del(self.__dict__[key])
+
+    # The rest only matter here through dir(self), which lists them into
+    # every instance's _method_keywords.
+    def _clear(self):
+        return self.__dict__.clear()
+
+    def _copy(self):
+        return self.__dict__.copy()
+
+    def _fromkeys(self, *args, **nargs):
+        return self.__dict__(*args, **nargs)
+
+    def _get(self, *args, **nargs):
+        return self.__dict__.get(*args, **nargs)
+
+    def _items(self):
+        return self.__dict__.items()
+
+    def _keys(self):
+        keys = list(self.__dict__.keys())
+        for item in self._method_keywords:
+            try:
+                del(keys[keys.index(item)])
+            except ValueError:
+                pass
+        return keys
+
+    def _mro(self):
+        return self.__dict__.mro()
+
+    def _pop(self, *args, **nargs):
+        return self.__dict__.pop(*args, **nargs)
+
+    def _popitem(self, *args, **nargs):
+        return self.__dict__.popitem(*args, **nargs)
+
+    def _setdefault(self, *args, **nargs):
+        return self.__dict__.pop(*args, **nargs)
+
+    def _update(self, *args, **nargs):
+        return self.__dict__.update(*args, **nargs)
+
+    def _values(self):
+        return self.__dict__.values()
+
+    def _asupdate(self):
+        compatible_dict = self._copy()
+        for key in self._method_keywords:
+            try:
+                del(compatible_dict[key])
+            except KeyError:
+                pass
+        return compatible_dict
+
+def _baseline_gene_init(self):
+    'geneNS.__init__ on the original nsdict: the same keys, set the same way.'
+    baseline_nsdict.__init__(self, autofix=True)
+    self['sequence'] = ''
+    self['transcripts'] = genomespace.LazyList(genomespace._feature_sequence)
+    self['orfs'] = genomespace.LazyList(genomespace._feature_sequence)
+    self['rna'] = []
+    self['features'] = []
+    self['aminos'] = genomespace.LazyList(genomespace._feature_translation)
+    self['meta'] = {}
+
+# geneNS's own methods and properties, so dir(self), and with it each
+# instance's reserved-name list, is as long as it was for the old geneNS.
+baseline_geneNS = type("baseline_geneNS", (baseline_nsdict,), dict(
+    {name: value for name, value in vars(genomespace.geneNS).items() if not name.startswith("__")},
+    __init__=_baseline_gene_init))
+
+def measure(make_gene, count):
+    'Returns (bytes per gene, seconds per gene) for making count genes.'
+    tracemalloc.start()
+    genes = [make_gene() for x in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del genes
+    seconds = min(timeit.repeat(lambda: [make_gene() for x in range(count)], number=1, repeat=3))
+    return size / count, seconds / count
+
+def main(count=5000):
+    # Both must hold the same keys for the comparison to mean anything.
+    assert sorted(baseline_geneNS().__dict__) == sorted(["_autofix", "_method_keywords"] + list(genomespace.geneNS()._keys()))
+    print("{0} geneNS objects:".format(count))
+    for name, make_gene in (("original nsdict", baseline_geneNS), ("slotted nsdict", genomespace.geneNS)):
+        size, seconds = measure(make_gene, count)
+        print("{0:>16}: {1:8.0f} bytes/gene  {2:6.1f} us/gene".format(name, size, seconds*1e6))
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+'''Benchmark: decoding a genbank ORIGIN block into a sequence string.
+Compares the old line-by-line strip/replace/upper loop against
+GenbankFile.process_sequence, which decodes the whole block with one
+bytes.translate pass. Run from the repository root:
+    python3 benchmarks/origin_decode.py [genome length]
+'''
+import os
+import random
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dnamespace import parsegb
+
+def make_origin_block(length):
+    'Builds ORIGIN lines as genbank writes them: 60 lowercase bases per line in groups of 10.'
+    random.seed(0)
+    bases = ''.join(random.choice("acgt") for x in range(length))
+    lines = ["ORIGIN      "]
+    for start in range(0, length, 60):
+        chunk = bases[start:start+60]
+        groups = ' '.join(chunk[x:x+10] for x in range(0, len(chunk), 10))
+        lines.append("{0:>9} {1}".format(start+1, groups))
+    return lines, bases.upper()
+
+def linewise_decode(origin_block_lines):
+    'The previous process_sequence loop, kept here for comparison.'
+    output = []
+    for line in origin_block_lines:
+        if not line.strip():
+            continue
+        elif line.strip() == "//":
+            break
+        elif line.strip() == "ORIGIN":
+            continue
+        else:
+            line_content = line.strip().strip("1234567890").replace(" ", "")
+            output.append(line_content.upper())
+    return ''.join(output)
+
+def main(length=5000000, repeats=5):
+    lines, expected = make_origin_block(length)
+    genbank = parsegb.GenbankFile(file_contents="LOCUS       benchmark")
+    def old_decode():
+        return linewise_decode(lines)
+    def bulk_decode():
+        genbank.process_sequence(lines)
+        return genbank['Sequence']
+    assert old_decode() == expected
+    assert bulk_decode() == expected
+    megabases = length / 1e6
+    print("ORIGIN block: {0:.1f} Mb in {1} lines, best of {2} runs".format(megabases, len(lines), repeats))
+    for name, function in (("line-by-line", old_decode), ("bytes.translate", bulk_decode)):
+        best = min(timeit.repeat(function, number=1, repeat=repeats))
+        print("{0:>16}: {1:7.3f} s  {2:7.1f} Mb/s".format(name, best, megabases/best))
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
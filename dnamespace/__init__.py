@@ -28,8 +28,18 @@ and has a list property called "cistrons". The "cds" property in the
 case of any given gene, polycistronic or no, contains the *first* CDS
 feature in the *feature table*, not necessarily the first in-sequence.
 '''
+from dnamespace import gbcache
 from dnamespace import genomespace
 from dnamespace.gnulicenses import Affero as license
 
-def new(filen):
-    return genomespace.genomespace(filen)
+def new(filen, use_cache=False, cache_dir=None, by_content=False, index_path=None):
+    '''Returns a genomespace for a genbank file. With use_cache set, parsed
+    genomes are snapshotted to disk and reloaded from there next time;
+    by_content checks snapshots against a hash of the file rather than its
+    size and modification time. dnamespace.gbcache.purge() clears the
+    snapshots. If index_path is given, the suffix index used by find_all
+    is saved there (seqindex.index_path gives the usual place, beside the
+    genbank file) and reloaded by later searches; otherwise it is kept in
+    memory only.'''
+    return genomespace.genomespace(filen, use_cache=use_cache, cache_dir=cache_dir,
+                                   by_content=by_content, index_path=index_path)
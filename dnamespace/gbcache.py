@@ -0,0 +1,101 @@
+'''gbcache - On-disk snapshots of parsed genomes.
+by Cathal Garvey
+Part of the DNAmespace project. License accessible as gbcache.license.
+
+Parsing a large genbank file takes seconds; loading a pickled snapshot of
+the parsed objects takes milliseconds. Snapshots live in a cache directory,
+one file per source genbank file (named by a hash of its absolute path),
+and each records the size and modification time of the file it was made
+from, or optionally a hash of its contents. A snapshot that no longer
+matches its source is ignored by load() and replaced by the next save().
+
+The cache directory is, in order of preference: the directory argument
+given to each function, the DNAMESPACE_CACHE environment variable, or
+~/.cache/dnamespace.
+'''
+from dnamespace.gnulicenses import Affero as license
+import hashlib
+import os
+import pickle
+
+# Written at the start of every snapshot; bump the number whenever the
+# layout of the pickled objects changes so old snapshots are ignored.
+snapshot_magic = b"DNAMSPC12"
+snapshot_suffix = ".dnsnap"
+
+def cache_dir(directory=None):
+    'Returns the cache directory that will be used for the given directory argument.'
+    if directory:
+        return directory
+    return os.environ.get("DNAMESPACE_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "dnamespace")
+
+def snapshot_path(file_name, directory=None):
+    'Returns the path of the snapshot for a genbank file.'
+    path_hash = hashlib.sha1(os.path.abspath(file_name).encode()).hexdigest()
+    return os.path.join(cache_dir(directory), path_hash + snapshot_suffix)
+
+def source_key(file_name, by_content=False):
+    '''Returns the key a snapshot of file_name is checked against.
+    By default this is the file's size and modification time; if by_content
+    is set, a SHA-1 of the file's contents is used instead, which survives
+    touching or copying the file but costs a full read.'''
+    if by_content:
+        content_hash = hashlib.sha1()
+        with open(file_name, "rb") as Source_File:
+            for chunk in iter(lambda: Source_File.read(1 << 20), b""):
+                content_hash.update(chunk)
+        return ("sha1", content_hash.hexdigest())
+    stats = os.stat(file_name)
+    return ("stat", stats.st_size, stats.st_mtime_ns)
+
+def load(file_name, directory=None, by_content=False):
+    'Returns the snapshot saved for file_name, or None if there is none or it is stale.'
+    try:
+        with open(snapshot_path(file_name, directory), "rb") as Snapshot:
+            if Snapshot.read(len(snapshot_magic)) != snapshot_magic:
+                return None
+            if pickle.load(Snapshot) != source_key(file_name, by_content):
+                return None
+            return pickle.load(Snapshot)
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # Missing, truncated or written by an incompatible version of
+        # DNAmespace: treat all of these as a cache miss.
+        return None
+
+def save(snapshot, file_name, directory=None, by_content=False):
+    '''Pickles snapshot as the cached copy of file_name, replacing any older one.
+    The snapshot is written to a temporary file and moved into place, so a
+    reader never sees a half-written snapshot. Returns the snapshot path.'''
+    path = snapshot_path(file_name, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+        with open(temporary_path, "wb") as Snapshot:
+            Snapshot.write(snapshot_magic)
+            pickle.dump(source_key(file_name, by_content), Snapshot, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(snapshot, Snapshot, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return path
+
+def purge(file_name=None, directory=None):
+    '''Deletes the snapshot for file_name, or every snapshot in the cache
+    directory if no file_name is given. Returns the number of files removed.'''
+    if file_name is not None:
+        paths = [snapshot_path(file_name, directory)]
+    else:
+        directory = cache_dir(directory)
+        try:
+            paths = [os.path.join(directory, x) for x in os.listdir(directory) if x.endswith(snapshot_suffix)]
+        except IOError:
+            return 0
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except IOError:
+            pass
+    return removed
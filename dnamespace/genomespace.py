@@ -29,7 +29,9 @@ and has a list property called "cistrons". The "cds" property in the
 case of any given gene, polycistronic or no, contains the *first* CDS
 feature in the *feature table*, not necessarily the first in-sequence.
 '''
+from dnamespace import gbcache
 from dnamespace import parsegb
+from dnamespace import seqindex
 from dnamespace import virtualns
 from dnamespace.gnulicenses import Affero as license
 
@@ -43,10 +45,82 @@ from dnamespace.gnulicenses import Affero as license
 # aminos        - a subclassed list of translations.
 # meta          - Metadata from genbank feature entry.
 # __doc__       - Set to one of the key feature table meta descriptors, like "note"
+import bisect
+import collections.abc
+import fnmatch
 import keyword
+import pickle
+import re
+
+# Qualifiers that genes can be looked up by, besides their names; see
+# genomespace._lookup. Each value of the first four belongs to one gene,
+# while synonyms and products can be shared by several.
+lookup_qualifiers = ("locus_tag", "old_locus_tag", "protein_id", "db_xref", "gene_synonym", "product")
+# The part of a wildcard pattern before its first wildcard:
+_literal_prefix = re.compile(r'[^*?\[]*')
+
+def _feature_sequence(gbfeature):
+    'Resolves the sequence of a GBFeature, for LazyList.'
+    return gbfeature.sequence
+
+def _feature_translation(gbfeature):
+    'Returns the annotated translation of a CDS where there is one, otherwise translates it, for LazyList.'
+    if 'translation' in gbfeature.meta:
+        return gbfeature.meta['translation']
+    return gbfeature.translate()
+
+class LazyList(collections.abc.Sequence):
+    '''A list of values worked out from GBFeatures only when they are read.
+    Should be given a function returning the value for a feature, like
+    _feature_sequence. Features added with add() are resolved on first
+    access and the value is then kept, in place of the feature; values
+    given to append() are stored as they are. Indexing, slicing (which returns a plain list), iteration
+    and comparison with lists all work as for a list, but only resolve the
+    entries they touch.'''
+    def __init__(self, resolve):
+        self._resolve = resolve
+        self._features = []
+        self._values = []
+
+    def add(self, gbfeature):
+        'Adds an entry to be resolved from gbfeature when first read.'
+        self._features.append(gbfeature)
+        self._values.append(None)
+
+    def append(self, value):
+        'Adds an already-resolved entry.'
+        self._features.append(None)
+        self._values.append(value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(len(self)))]
+        # Entries still holding their feature are unresolved.
+        if self._features[index] is not None:
+            self._values[index] = self._resolve(self._features[index])
+            self._features[index] = None
+        return self._values[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, LazyList)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+    @property
+    def resolved(self):
+        'The number of entries resolved so far.'
+        return self._features.count(None)
 
 class geneNS(virtualns.nsdict):
     'Present a namespace or dict interface for a gene.'
+    # No per-instance slots beyond nsdict's; this also leaves out __weakref__.
+    __slots__ = ()
     # Only "db_xref; locus_tag; gene" were common to all genes in E.coli DH10B.
     # These keys are not necessarily common to all sub-gene features, and are
     # not common to *all* features (i.e. "gene" will not be found in "origin")
@@ -62,17 +136,20 @@ class geneNS(virtualns.nsdict):
         self['sequence'] = ''
         # transcripts are rna copies of DNA, and are either from CDS
         # or RNA features.
-        self['transcripts'] = []
+        # transcripts, orfs and aminos are LazyLists, so no sequence is
+        # resolved or translated until it is asked for.
+        self['transcripts'] = LazyList(_feature_sequence)
         # orfs and rnas are subsets of transcripts: Entries in either list
         # will always be duplicated in transcripts.
-        self['orfs'] = []
+        self['orfs'] = LazyList(_feature_sequence)
         self['rna'] = []
         self['features'] = []
-        self['aminos'] = []
+        self['aminos'] = LazyList(_feature_translation)
         self['meta'] = {}
 
     @property
     def transcript(self):
+        # Resolves only the first entry of each list:
         if self['transcripts']:
             return self['transcripts'][0]
 
@@ -106,18 +183,13 @@ class geneNS(virtualns.nsdict):
     def _handle_CDS(self, gbfeature):
         'Imports CDS-specific data.'
         # Should possibly try to determine order relative to existing
-        # entries, *without* calling the sequence property (to save CPU/RAM).
-        # Might need to refactor parsegb to allow intermediate range calcs:
-        # i.e. features are parsed to get range in a native format at init,
-        # but sequence isn't read until called. Range can then easily be
-        # read/compared by client software like dnamespace.
-        self['transcripts'].append(gbfeature.sequence)
-        self['orfs'].append(gbfeature.sequence)
-        # Need to handle translations and put in self['aminos'].
-        try:
-            self['aminos'].append(gbfeature.meta['translation'])
-        except KeyError:
-            NotImplementedError("No translation found for CDS {0}, and translation from nucleotides is not yet implemented.".format(gbfeature.meta['gene']))
+        # entries, *without* calling the sequence property (to save CPU/RAM);
+        # gbfeature.start and gbfeature.strand now allow this.
+        # Sequences are only resolved, and CDSs without an annotated
+        # translation only translated, when first read.
+        self['transcripts'].add(gbfeature)
+        self['orfs'].add(gbfeature)
+        self['aminos'].add(gbfeature)
 
     def _handle_gene(self, gbfeature):
         'Imports gene-specific data.'
@@ -160,66 +232,240 @@ class geneNS(virtualns.nsdict):
         # product: Often describes the translation product.
 
 class genomespace:
-    '''Provides a namespace-like object interface to a genbank file.'''
-    def __init__(self, gb_file, keepfile=False):
+    '''Provides a namespace-like object interface to a genbank file.
+    If use_cache is set, the parsed genome is snapshotted to disk with
+    gbcache (in cache_dir, if given) and later loads of the same, unchanged
+    file are served from the snapshot instead of being re-parsed; with
+    by_content set, "unchanged" is judged by a hash of the file rather than
+    its size and modification time. Cached genomes store their sequence
+    packed; see seqstore.PackedSequence. A snapshot that can't be written
+    is skipped, leaving the parsed genome usable.
+    find_all() searches the genome through a suffix index, built in memory
+    on the first search; if index_path is given, the index is loaded from
+    there when current and saved there otherwise. See seqindex.
+    Genes are available as attributes, but each gene's geneNS is only made,
+    from its features, the first time it is asked for. Features with no
+    gene name are grouped by their locus_tag instead. Genes can also be
+    found by the qualifiers in lookup_qualifiers, through _by_locus_tag and
+    its siblings, which are dict lookups, and by name prefix or wildcard
+    pattern through _prefixed and _find.'''
+    def __init__(self, gb_file, keepfile=False, use_cache=False, cache_dir=None, by_content=False, index_path=None):
         'Should be created with a path or filename for a valid genbank file.'
-        self._gbfile = parsegb.GenbankFile(file_name=gb_file)
+        if use_cache:
+            snapshot = gbcache.load(gb_file, cache_dir, by_content)
+            # Snapshots taken with keepfile set can serve either setting,
+            # but one taken without it can't satisfy keepfile.
+            if snapshot is not None and (not keepfile or '_gbfile' in snapshot):
+                self.__dict__.update(snapshot)
+                if not keepfile:
+                    self.__dict__.pop('_gbfile', None)
+                self._index_path = index_path
+                return
+        self._gbfile = parsegb.GenbankFile(file_name=gb_file, packed=use_cache)
+        # The sequence and feature table outlive the GenbankFile attribute,
+        # for searching and for making gene namespaces:
+        self._sequence = self._gbfile['Sequence']
+        self._features = self._gbfile['Features']
+        self._source = gb_file
+        # Suffix index, made or loaded on the first search:
+        self._index = None
+        self._index_path = index_path
         # GenbankFiles have a .features list containing GBFeature objects
         # The GBFeature meta dict will usually contain a "gene" key:
         # Actual gene entries have this, and sub-parts of the gene will
-        # usually do so, too. So, DNAmespace first parses features to
-        # subordinate anything with a "gene" entry into a dict keyed by
-        # gene name.
+        # usually do so, too. So, DNAmespace first scans features to
+        # subordinate anything with a "gene" entry to its gene name.
         self._subordinate_genes()
-        # Make all gene dict entry names into properties:
+        # Map attribute names to gene names, for __getattr__:
         self._make_gene_properties()
-        # If sequences have already been looked-up and internalised,
-        # then we can save some RAM by deleting the original gbfile
-        # object.
+        # The features stay reachable through self._features, so this
+        # only drops the GenbankFile attribute itself.
         if not keepfile:
             del(self._gbfile)
+        if use_cache:
+            # Saved after dropping _gbfile, so only snapshots taken with
+            # keepfile carry it. Features are saved unbuilt, as raw lines,
+            # and built from the snapshot when their gene is first asked
+            # for, as after parsing.
+            try:
+                gbcache.save(self.__dict__, gb_file, cache_dir, by_content)
+            except (OSError, pickle.PicklingError):
+                # The cache is only an optimisation; an unwritable cache
+                # directory shouldn't cost the genome just parsed.
+                pass
+
+    def __getattr__(self, attribute):
+        'Makes the geneNS for a gene attribute on first access.'
+        # Private names (and lookups made while unpickling, before
+        # __dict__ is filled) are never genes.
+        if attribute.startswith("_") or attribute not in self.__dict__.get('_gene_attributes', ()):
+            raise AttributeError("{0!r} is not a gene or attribute of this genomespace.".format(attribute))
+        return self._make_feature_namespace(self._gene_attributes[attribute])
+
+    def __dir__(self):
+        if self._dir is None:
+            self._dir = sorted(set(object.__dir__(self)) | set(self._gene_attributes))
+        return self._dir
+
+    def find_all(self, pattern):
+        '''Returns (start, end, strand) for every occurrence of pattern on either strand.
+        pattern may hold IUPAC ambiguity codes. Coordinates are 0-based and
+        half-open on the forward strand. The first search loads or builds the
+        genome's suffix index (requires numpy); see seqindex.SuffixIndex.'''
+        if self._index is None:
+            self._index = seqindex.open_index(self._sequence, self._index_path)
+        return self._index.find_all(pattern)
 
     def _subordinate_genes(self):
-        'Parse genbank file features and organise by gene name.'
+        '''Scan genbank file features and organise them by gene name.
+        Only the "gene" and lookup_qualifiers qualifiers are read, in one
+        pass over the raw feature table; self._gene_features maps each gene
+        name to its feature indices, in file order, and self._lookups maps
+        each lookup qualifier's values to the names of the genes whose
+        features carry them. Features without a "gene" qualifier join the
+        gene sharing their locus_tag, or else a gene named after the
+        locus_tag itself. Features are built when their gene is first
+        asked for, into self._genes.'''
         self._genes = {}
-        for feature in self._gbfile.features:
-            try:
-                gene_name = feature.meta['gene']
-                # If no gene name is found, none of the below happen..
-                if gene_name not in self._genes.keys():
-                    # Create new geneNS object in self._genes.
-                    # self._genes keys are not directly exposed, they
-                    # are first parsed to suffix reserved keywords with "_",
-                    # so a gene might be called "def" in self._genes, but
-                    # be self.def_ when called as a property.
-                    self._genes[gene_name] = geneNS()
-                # Now that we know there's a geneNS object with this name
-                # we'll pass the feature to the geneNS object's handler.
-                self._genes[gene_name]._import_gbfeature(feature)
-
-            except KeyError:
-                # For now, we don't care about features with incomplete
-                # metadata and no "gene" meta; important or useful genes
-                # are likely to have correct meta.
-                # Would be nice to write a "last resort" method to find
-                # requested features that weren't successfully extracted
-                # if possible? Perhaps appending this method to a custom
-                # __getattr__ method and making it contingent on an
-                # instance argument, like "desperate=True"?
-                pass
+        # A feature with several "gene" qualifiers belongs to the last, as
+        # in GBFeature.meta:
+        feature_genes = {}
+        # Likewise for "locus_tag", used to place features without a gene:
+        feature_locus_tags = {}
+        # (feature index, qualifier, value) for every lookup qualifier:
+        lookup_values = []
+        for index, meta_name, value in self._features.scan_qualifiers("gene", *lookup_qualifiers):
+            if meta_name == "gene":
+                feature_genes[index] = value
+            elif meta_name == "gene_synonym":
+                # Synonyms come as one "; "-separated list.
+                lookup_values.extend((index, meta_name, x.strip()) for x in value.split(";") if x.strip())
+            else:
+                if meta_name == "locus_tag":
+                    feature_locus_tags[index] = value
+                lookup_values.append((index, meta_name, value))
+        # Many annotations (e.g. RefSeq prokaryotes) name only some genes,
+        # leaving the rest identified by locus_tag. Such features join the
+        # first named gene with the same locus_tag, or else are grouped
+        # under the locus_tag as their gene name.
+        locus_genes = {}
+        for index in sorted(feature_genes):
+            if index in feature_locus_tags:
+                locus_genes.setdefault(feature_locus_tags[index], feature_genes[index])
+        for index, locus_tag in feature_locus_tags.items():
+            if index not in feature_genes:
+                feature_genes[index] = locus_genes.get(locus_tag, locus_tag)
+        # Features with neither qualifier (e.g. source, repeat_region)
+        # belong to no gene.
+        self._gene_features = {}
+        for index in sorted(feature_genes):
+            self._gene_features.setdefault(feature_genes[index], []).append(index)
+        # Only features belonging to a gene can be looked up.
+        # Each value's genes are the keys of a dict, as an ordered set, so
+        # values shared by many genes (like "hypothetical protein") stay
+        # one dict operation per feature.
+        self._lookups = {x: {} for x in lookup_qualifiers}
+        for index, meta_name, value in lookup_values:
+            if index in feature_genes:
+                self._lookups[meta_name].setdefault(value, {})[feature_genes[index]] = True
+
+    def _lookup(self, qualifier, value):
+        '''Returns the geneNS of every gene with a feature carrying qualifier=value.
+        qualifier is one of lookup_qualifiers. Genes come in file order, and
+        an unknown value gives an empty list.'''
+        return [self._make_feature_namespace(x) for x in self._lookups[qualifier].get(value, ())]
+
+    def _lookup_one(self, qualifier, value):
+        'Returns the geneNS a qualifier value belongs to, raising KeyError if none does.'
+        genes = self._lookup(qualifier, value)
+        if not genes:
+            raise KeyError("No gene has {0} {1!r}.".format(qualifier, value))
+        return genes[0]
+
+    def _by_locus_tag(self, locus_tag):
+        'Returns the geneNS with this /locus_tag, e.g. "b0344"; raises KeyError if none.'
+        return self._lookup_one("locus_tag", locus_tag)
+
+    def _by_old_locus_tag(self, old_locus_tag):
+        'Returns the geneNS with this /old_locus_tag; raises KeyError if none.'
+        return self._lookup_one("old_locus_tag", old_locus_tag)
+
+    def _by_protein_id(self, protein_id):
+        'Returns the geneNS with this /protein_id, e.g. "NP_414878.1"; raises KeyError if none.'
+        return self._lookup_one("protein_id", protein_id)
+
+    def _by_db_xref(self, db_xref):
+        'Returns the geneNS with this /db_xref, e.g. "GeneID:945006"; raises KeyError if none.'
+        return self._lookup_one("db_xref", db_xref)
+
+    def _by_gene_synonym(self, synonym):
+        'Returns a list of the geneNS objects with this /gene_synonym.'
+        return self._lookup("gene_synonym", synonym)
+
+    def _by_product(self, product):
+        'Returns a list of the geneNS objects with exactly this /product.'
+        return self._lookup("product", product)
+
+    def _name_range(self, prefix):
+        '''Returns the (first, last) range of self._names beginning with prefix.
+        Gene names and synonyms are kept sorted, with the gene each belongs
+        to in self._name_genes, so a prefix is two binary searches.'''
+        if self._names is None:
+            names = [(x, x) for x in self._gene_features]
+            for synonym, gene_names in self._lookups["gene_synonym"].items():
+                names.extend((synonym, x) for x in gene_names)
+            names.sort()
+            self._names = [x[0] for x in names]
+            self._name_genes = [x[1] for x in names]
+        first = bisect.bisect_left(self._names, prefix)
+        # Everything beginning with prefix sorts before prefix + the highest character.
+        last = bisect.bisect_left(self._names, prefix + chr(0x10ffff), first)
+        return first, last
+
+    def _prefixed(self, prefix):
+        'Returns the sorted gene names and synonyms beginning with prefix, e.g. "lac".'
+        first, last = self._name_range(prefix)
+        return sorted(set(self._names[first:last]))
+
+    def _find(self, pattern):
+        '''Returns the geneNS of every gene whose name or a synonym matches pattern.
+        pattern is a case-sensitive shell-style wildcard like "lac*" or
+        "gen?1*" (see fnmatch). Only names sharing the pattern's literal
+        prefix are tested against it. Genes are listed once each, in order
+        of their first matching name.'''
+        first, last = self._name_range(_literal_prefix.match(pattern).group())
+        found = {}
+        for position in range(first, last):
+            gene_name = self._name_genes[position]
+            if gene_name not in found and fnmatch.fnmatchcase(self._names[position], pattern):
+                found[gene_name] = True
+        return [self._make_feature_namespace(x) for x in found]
 
     def _make_gene_properties(self):
-        for gene_name in self._genes.keys():
+        '''Maps attribute names to gene names. Gene names are not directly
+        exposed, they are first parsed to suffix reserved keywords with "_",
+        so a gene might be called "def" in self._gene_features, but be
+        self.def_ when called as a property.'''
+        self._gene_attributes = {}
+        for gene_name in self._gene_features.keys():
             if gene_name in keyword.kwlist:
                 # This is ugly but necessary, sadly..
                 new_gene_name = gene_name + "_"
             else:
                 new_gene_name = gene_name
-            # Make this less simplistic; features must have a namespace-
-            # like interface, too.
-            self.__dict__[new_gene_name] = self._genes[gene_name]
+            self._gene_attributes[new_gene_name] = gene_name
+        # Attribute listing for __dir__, made on first use:
+        self._dir = None
+        # Sorted gene names and synonyms for _prefixed and _find, made on first use:
+        self._names = None
+        self._name_genes = None
 
     def _make_feature_namespace(self, gene_name):
-        'Presents a namespace interface to a self.genes dict entry.'
-        # This returning of dict objects is a dumb space-filler for now.
+        'Presents a namespace interface to a gene, making its geneNS on first use.'
+        if gene_name not in self._genes:
+            gene = geneNS()
+            # Pass each feature to the geneNS object's handler, in file order.
+            for index in self._gene_features[gene_name]:
+                gene._import_gbfeature(self._features[index])
+            self._genes[gene_name] = gene
         return self._genes[gene_name]
@@ -0,0 +1,65 @@
+'''intervals - A static interval index for coordinate-range queries.
+by Cathal Garvey
+Part of the DNAmespace project. License accessible as intervals.license.
+
+IntervalIndex is built once from (start, end, value) triples and answers
+"which intervals overlap this range?" without scanning them all. Intervals
+are half-open, as in Python slicing: (10, 20) covers positions 10 to 19.
+This module is standalone apart from gnulicenses.
+'''
+from dnamespace.gnulicenses import Affero as license
+import array
+import bisect
+
+class IntervalIndex:
+    '''Overlap index over a fixed set of half-open intervals.
+    Intervals are sorted by start into flat arrays. Over them sits an
+    implicit binary tree (heap-ordered, in a single array) holding the
+    largest end found under each node. A query bisects the starts to drop
+    everything starting at or after the query end, then walks the tree,
+    skipping any subtree whose largest end falls at or before the query
+    start. Cost is logarithmic in the number of intervals for each hit,
+    however long or nested the intervals are, which matters for genbank
+    files where a "source" feature spans the whole genome.'''
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda x: (x[0], x[1]))
+        self.starts = array.array('q', (x[0] for x in intervals))
+        self.ends = array.array('q', (x[1] for x in intervals))
+        self.values = [x[2] for x in intervals]
+        self._leaves = 1
+        while self._leaves < len(intervals):
+            self._leaves *= 2
+        # Node 1 is the root; the children of node n are 2n and 2n+1, and
+        # leaf i is node self._leaves+i. Empty leaves can never match.
+        lowest = min(self.starts, default=0) - 1
+        self._max_ends = array.array('q', [lowest]) * (2 * self._leaves)
+        self._max_ends[self._leaves:self._leaves+len(intervals)] = self.ends
+        for node in range(self._leaves-1, 0, -1):
+            self._max_ends[node] = max(self._max_ends[2*node], self._max_ends[2*node+1])
+
+    def __len__(self):
+        return len(self.values)
+
+    def overlapping_positions(self, start, end):
+        'Yields the sorted positions of intervals overlapping start to end, in start order.'
+        # Only intervals starting before the query end can overlap it.
+        limit = bisect.bisect_left(self.starts, end)
+        if not limit:
+            return
+        # Depth-first, left child first, so positions come out in order.
+        stack = [(1, 0, self._leaves)]
+        while stack:
+            node, first, width = stack.pop()
+            if first >= limit or self._max_ends[node] <= start:
+                continue
+            if width == 1:
+                yield first
+                continue
+            width //= 2
+            stack.append((2*node+1, first+width, width))
+            stack.append((2*node, first, width))
+
+    def overlapping(self, start, end):
+        'Yields the values of intervals overlapping start to end, in start order.'
+        for position in self.overlapping_positions(start, end):
+            yield self.values[position]
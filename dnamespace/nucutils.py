@@ -3,6 +3,9 @@ by Cathal Garvey
 Part of the DNAmespace project. License accessible as nucutils.license.
 '''
 from dnamespace.gnulicenses import Affero as license
+import itertools
+import re
+import string
 
 iupac_characters = [ 'A', 'T', 'C', 'G', 'U',    # Canonical bases
                      'B', 'V', 'D', 'H',     # B=Not A, V=Not T, D=Not C, H=Not G
@@ -10,6 +13,10 @@ iupac_characters = [ 'A', 'T', 'C', 'G', 'U',    # Canonical bases
                      'K', 'M',               # "Keto" and "aMino": GT vs. AC
                      'R', 'Y',               # "puRine" and "pYrimidine": AG vs CT
                      'N', '.', '-' ]         # Wildcards: any N.
+iupac_set = frozenset(iupac_characters)
+# Deleting every IUPAC character with bytes.translate leaves only the
+# illegal ones, so validation is one C-level pass over the sequence.
+_iupac_bytes = ''.join(iupac_characters).encode()
 
 # All complements are in lowercase so that string substitution is simple:
 # just set string to uppercase (if not already), replace all characters
@@ -33,6 +40,23 @@ rnaiupaccomplement = {   # Translates to an IUPAC sequence of potential compleme
               "H":   "d", "D": "h", "M":   "k", "K": "m",
               "R":   "y", "Y": "r", "V":   "b", "B": "v",
               "N":   "n"}
+# The same complements as str.translate tables, so a whole sequence can be
+# complemented in one pass. Wildcards without a complement ('.', '-') are
+# left alone by translate.
+dnacomplement_table = str.maketrans({k: v.upper() for k, v in dnaiupaccomplement.items()})
+rnacomplement_table = str.maketrans({k: v.upper() for k, v in rnaiupaccomplement.items()})
+
+# Tables for cleaning raw genbank ORIGIN text with bytes.translate: the
+# base numbering and all whitespace are deleted, and bases are uppercased.
+origin_noise = (string.digits + string.whitespace).encode()
+origin_uppercase = bytes.maketrans(string.ascii_lowercase.encode(), string.ascii_uppercase.encode())
+
+def origin_to_bases(origin_bytes):
+    '''Given raw ORIGIN lines as bytes, returns their bases as an uppercase str.
+    This is a single bytes.translate pass, so whole ORIGIN regions can be
+    decoded at once rather than line by line. Each non-ASCII byte becomes
+    one U+FFFD character, which deduce_alphabet rejects as a non-base.'''
+    return origin_bytes.translate(origin_uppercase, origin_noise).decode("ascii", errors="replace")
 
 def _uniquify(string):
     '''Reduces a string down to its component characters.
@@ -42,31 +66,232 @@ def _uniquify(string):
     seen = set()
     return [x for x in string if x not in seen and not seen.add(x)]
 
+def illegal_characters(string):
+    'Returns the set of characters in string that are not IUPAC nucleotide codes.'
+    try:
+        return set(string.encode("ascii").translate(None, _iupac_bytes).decode("ascii"))
+    except UnicodeEncodeError:
+        # Anything outside ASCII is illegal anyway; take the slow path.
+        return set(string) - iupac_set
+
 def deduce_alphabet(string):
-    charset = _uniquify(string)
-    for character in charset:
-        if character not in iupac_characters:
-            raise ValueError(("Non-base found in nucleotides string."
-                  " The string consists of the following characters:\n")
-                  +str(charset))
-    if "T" in charset and "U" in charset:
+    '''Validates a nucleotide string and returns its IUPAC complement dict.
+    Raises ValueError for non-IUPAC characters or hybrid DNA/RNA sequences.
+    Each check is a single C-level pass, so whole genomes can be validated.'''
+    if illegal_characters(string):
+        raise ValueError(("Non-base found in nucleotides string."
+              " The string consists of the following characters:\n")
+              +str(sorted(set(string))))
+    if "T" in string and "U" in string:
         raise ValueError(("Cannot get reverse complement of a hybrid"
                           " DNA/RNA sequence."))
-    elif "U" in charset:
+    elif "U" in string:
         basedict = rnaiupaccomplement
     else:
         basedict = dnaiupaccomplement
     return basedict
 
-def get_complement(nucleotides):
-    'Given a string of nucleotides (RNA *or* DNA), return reverse complement.'
-    # Reverse the string:
-    nucleotides = nucleotides[::-1]
-    # Determine molecule type:
-    basedict = deduce_alphabet(nucleotides)
-    for base in basedict.keys():
-        # Replace each base with its complementary base in lowercase:
-        # (lowercase means previously substituted bases aren't replaced)
-        nucleotides = nucleotides.replace(base, basedict[base])
-    # Return sequence in uppercase:
-    return nucleotides.upper()
+def _complement_table(basedict):
+    'Returns the str.translate table matching a complement dict from deduce_alphabet.'
+    if basedict is rnaiupaccomplement:
+        return rnacomplement_table
+    return dnacomplement_table
+
+def get_complement(nucleotides, alphabet=None):
+    '''Given a string of nucleotides (RNA *or* DNA), return reverse complement.
+    alphabet may be a complement dict that deduce_alphabet already returned
+    for this sequence, or for a validated sequence containing it, in which
+    case the sequence is not checked again.'''
+    if alphabet is None:
+        alphabet = deduce_alphabet(nucleotides)
+    # Reverse and complement in one pass each:
+    return nucleotides[::-1].translate(_complement_table(alphabet))
+
+def get_complements(sequences, alphabet=None):
+    '''Given an iterable of nucleotide strings, returns a list of their reverse complements.
+    The sequences are validated, reversed and complemented together as one
+    newline-joined string, which avoids per-sequence call overhead when
+    complementing thousands of minus-strand features. Reversing the joined
+    string also reverses the order of the sequences, so the split result is
+    put back in input order. alphabet is as for get_complement.'''
+    sequences = list(sequences)
+    if not sequences:
+        return []
+    if alphabet is None:
+        try:
+            alphabet = deduce_alphabet(''.join(sequences))
+        except ValueError:
+            # A batch mixing DNA and RNA sequences looks like one hybrid; do
+            # them one at a time, which either copes or raises for the culprit.
+            return [get_complement(x) for x in sequences]
+    table = _complement_table(alphabet)
+    return "\n".join(sequences)[::-1].translate(table).split("\n")[::-1]
+
+# NCBI genetic codes ("transl_table" numbers), as given in NCBI's gc.prt:
+# the amino acid for every codon, then "M" wherever the codon may act as an
+# initiator. Codons run in TCAG order: TTT, TTC, TTA, TTG, TCT ... GGG.
+translation_tables = {
+    1:  ("FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "---M------**--*----M---------------M----------------------------"),
+    2:  ("FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG",
+         "----------**--------------------MMMM----------**---M------------"),
+    3:  ("FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------**----------------------MM---------------M------------"),
+    4:  ("FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "--MM------**-------M------------MMMM---------------M------------"),
+    5:  ("FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG",
+         "---M------**--------------------MMMM---------------M------------"),
+    6:  ("FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "--------------*--------------------M----------------------------"),
+    9:  ("FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+         "----------**-----------------------M---------------M------------"),
+    10: ("FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------**-----------------------M----------------------------"),
+    11: ("FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "---M------**--*----M------------MMMM---------------M------------"),
+    12: ("FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------**--*----M---------------M----------------------------"),
+    13: ("FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG",
+         "---M------**----------------------MM---------------M------------"),
+    14: ("FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+         "-----------*-----------------------M----------------------------"),
+    15: ("FFLLSSSSYY*QCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------*---*--------------------M----------------------------"),
+    16: ("FFLLSSSSYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------*---*--------------------M----------------------------"),
+    21: ("FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+         "----------**-----------------------M---------------M------------"),
+    22: ("FFLLSS*SYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "------*---*---*--------------------M----------------------------"),
+    23: ("FF*LSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "--------------------------------M--M---------------M------------"),
+    24: ("FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG",
+         "---M------**-------M---------------M---------------M------------"),
+    25: ("FFLLSSSSYY**CCGWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "---M------**-----------------------M---------------M------------"),
+    26: ("FFLLSSSSYY**CC*WLLLAPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------**--*----M---------------M----------------------------"),
+    27: ("FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "--------------*--------------------M----------------------------"),
+    28: ("FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------**--*--------------------M----------------------------"),
+    29: ("FFLLSSSSYYYYCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "--------------*--------------------M----------------------------"),
+    30: ("FFLLSSSSYYEECC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "--------------*--------------------M----------------------------"),
+    31: ("FFLLSSSSYYEECCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "----------**-----------------------M----------------------------"),
+    32: ("FFLLSSSSYY*WCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+         "---M------*---*----M------------MMMM---------------M------------"),
+    33: ("FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG",
+         "---M-------*-------M---------------M---------------M------------"),
+    }
+
+# Three-letter amino acid names as used in /transl_except qualifiers:
+amino_acid_codes = {"Ala": "A", "Arg": "R", "Asn": "N", "Asp": "D",
+                    "Cys": "C", "Gln": "Q", "Glu": "E", "Gly": "G",
+                    "His": "H", "Ile": "I", "Leu": "L", "Lys": "K",
+                    "Met": "M", "Phe": "F", "Pro": "P", "Ser": "S",
+                    "Thr": "T", "Trp": "W", "Tyr": "Y", "Val": "V",
+                    "Sec": "U", "Pyl": "O", "Asx": "B", "Glx": "Z",
+                    "Xle": "J", "Xaa": "X", "OTHER": "X", "TERM": "*"}
+
+# The canonical bases each IUPAC code may stand for:
+iupac_expansions = {"A": "A", "C": "C", "G": "G", "T": "T", "U": "T",
+                    "R": "AG", "Y": "CT", "S": "CG", "W": "AT",
+                    "K": "GT", "M": "AC", "B": "CGT", "D": "AGT",
+                    "H": "ACT", "V": "ACG", "N": "ACGT"}
+
+_codon_pattern = re.compile(r'.{3}', re.DOTALL)
+
+class _CodonTable(dict):
+    '''Maps codons to amino acids for one genetic code.
+    Holds the 64 DNA codons up front. Anything else (RNA, lowercase or
+    IUPAC-ambiguous codons) is worked out on first lookup and remembered:
+    an ambiguous codon gets an amino acid only if every codon it could
+    stand for agrees, and "X" otherwise.'''
+    def __init__(self, table):
+        aminos, starts = translation_tables[table]
+        codons = [''.join(x) for x in itertools.product("TCAG", repeat=3)]
+        dict.__init__(self, zip(codons, aminos))
+        self.starts = frozenset(x for x, s in zip(codons, starts) if s == "M")
+
+    def __missing__(self, codon):
+        try:
+            choices = [iupac_expansions[x] for x in codon.upper()]
+            aminos = set(dict.__getitem__(self, ''.join(x)) for x in itertools.product(*choices))
+        except KeyError:
+            aminos = ()
+        amino = aminos.pop() if len(aminos) == 1 else "X"
+        self[codon] = amino
+        return amino
+
+_codon_tables = {}
+
+def codon_table(table=1):
+    'Returns the (shared, cached) codon to amino acid dict for an NCBI transl_table number.'
+    table = int(table)
+    if table not in _codon_tables:
+        if table not in translation_tables:
+            raise ValueError("Unknown translation table: {0}".format(table))
+        _codon_tables[table] = _CodonTable(table)
+    return _codon_tables[table]
+
+def translate(nucleotides, table=1, codon_start=1, exceptions=None, cds=False, partial_start=False):
+    '''Translates a nucleotide string (DNA or RNA) into amino acids.
+    table is an NCBI transl_table number. Reading starts at codon_start
+    (1, 2 or 3, as in the genbank qualifier) and any incomplete final codon
+    is dropped. exceptions may map codon numbers (0 for the first codon
+    read) to amino acids, as given by /transl_except. If cds is set, the
+    output follows genbank /translation conventions: a first codon that is
+    an initiator in this table is read as "M" (when codon_start is 1 and
+    partial_start isn't set, as for a CDS missing its 5' end), and a
+    final stop is dropped.
+    Codons are looked up in a prebuilt table, one dict lookup per codon.'''
+    codons = codon_table(table)
+    codon_list = _codon_pattern.findall(nucleotides, int(codon_start)-1)
+    aminos = list(map(codons.__getitem__, codon_list))
+    # Only a read from the first base can begin on the real start codon.
+    if cds and not partial_start and int(codon_start) == 1 and codon_list and codon_list[0].upper().replace("U", "T") in codons.starts:
+        aminos[0] = "M"
+    if exceptions:
+        for codon_number, amino in exceptions.items():
+            if 0 <= codon_number < len(aminos):
+                aminos[codon_number] = amino
+    if cds and aminos and aminos[-1] == "*":
+        aminos.pop()
+    return ''.join(aminos)
+
+def translate_many(sequences, table=1, codon_start=1, cds=False):
+    'Translates an iterable of nucleotide strings with one shared table; returns a list.'
+    return [translate(x, table, codon_start, None, cds) for x in sequences]
+
+# Checks for tests(): the standard code by amino acid, the codons where
+# some NCBI tables differ from it, and each table's initiators, all as
+# listed in NCBI's gc.prt.
+_standard_code = {"F": "TTT TTC", "L": "TTA TTG CTT CTC CTA CTG", "I": "ATT ATC ATA",
+                  "M": "ATG", "V": "GTT GTC GTA GTG", "S": "TCT TCC TCA TCG AGT AGC",
+                  "P": "CCT CCC CCA CCG", "T": "ACT ACC ACA ACG", "A": "GCT GCC GCA GCG",
+                  "Y": "TAT TAC", "*": "TAA TAG TGA", "H": "CAT CAC", "Q": "CAA CAG",
+                  "N": "AAT AAC", "K": "AAA AAG", "D": "GAT GAC", "E": "GAA GAG",
+                  "C": "TGT TGC", "W": "TGG", "R": "CGT CGC CGA CGG AGA AGG",
+                  "G": "GGT GGC GGA GGG"}
+_gc_prt_differences = {1: {}, 2: {"AGA": "*", "AGG": "*", "ATA": "M", "TGA": "W"},
+                       4: {"TGA": "W"}, 11: {}}
+_gc_prt_starts = {1: "TTG CTG ATG", 2: "ATT ATC ATA ATG GTG",
+                  4: "TTA TTG CTG ATT ATC ATA ATG GTG", 11: "TTG CTG ATT ATC ATA ATG GTG"}
+
+def tests():
+    'Checks every codon and initiator of tables 1, 2, 4 and 11 against NCBI gc.prt.'
+    standard = {codon: amino for amino, codons in _standard_code.items() for codon in codons.split()}
+    assert len(standard) == 64, "Standard code reference is incomplete."
+    for table, differences in sorted(_gc_prt_differences.items()):
+        codons = codon_table(table)
+        for codon, amino in sorted(standard.items()):
+            expected = differences.get(codon, amino)
+            assert codons[codon] == expected, "Table {0}: {1} is {2}, not {3}.".format(table, codon, codons[codon], expected)
+        assert codons.starts == frozenset(_gc_prt_starts[table].split()), "Table {0}: wrong initiators.".format(table)
+        print("Table {0}: all 64 codons and initiators match gc.prt.".format(table))
+
+if __name__ == "__main__":
+    tests()
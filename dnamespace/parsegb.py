@@ -19,53 +19,131 @@ and has more advanced code for dealing with the target sequence. It can parse
 sequence referral lines like "complement(order(10..40,500..743))" and fetch/
 invert/complement the target sequence into a contiguous string accessible by
 the property self.sequence.
+Files holding several "//"-terminated records (a chromosome plus plasmids,
+or a whole RefSeq release) can be walked one record at a time with
+iter_records, which yields a separate GenbankFile per record.
 '''
 
+from dnamespace import intervals
 from dnamespace import nucutils
+from dnamespace import seqarray
+from dnamespace import seqindex
+from dnamespace import seqstore
 from dnamespace.gnulicenses import Affero as license
+from concurrent import futures
+import array
+import itertools
+import mmap
 import re
 
+_location_function = re.compile(r'(join|order|complement)\(')
+_location_range = re.compile(r'[<>]?([0-9]+)(?:(?:\.\.?|\^)[<>]?([0-9]+))?')
+# A bound marked as lying beyond the given position, like "<1" or ">240":
+_partial_bound = re.compile(r'([<>])([0-9]+)')
+
+def parse_location(spanline):
+    '''Parses a genbank range specifier into a flat array of (start, end, strand) triples.
+    Each triple is one segment: 0-based, half-open bounds on the sequence and
+    a strand of 1 or -1. Segments are listed in the order they are assembled
+    into the feature's sequence, so "complement(join(1..10,20..30))" becomes
+    [19, 30, -1, 0, 10, -1]. Any depth of join/complement/order nesting is
+    handled. Raises ValueError for anything that can't be parsed, including
+    references to other accessions ("AB1234.1:1..80").'''
+    segments, position = _parse_location(spanline, 0)
+    if position != len(spanline):
+        raise ValueError("Unexpected text in location: " + spanline[position:])
+    return array.array('l', itertools.chain.from_iterable(segments))
+
+def _parse_location(spanline, position):
+    '''Parses one location expression from spanline at position.
+    Returns a list of (start, end, strand) tuples and the position after it.'''
+    function = _location_function.match(spanline, position)
+    if not function:
+        span = _location_range.match(spanline, position)
+        if not span:
+            raise ValueError("Unrecognised location: " + spanline[position:])
+        # a..b and a^b both fetch bases a to b; a alone is a single base.
+        first = int(span.group(1))
+        last = int(span.group(2) or first)
+        return [(first-1, last, 1)], span.end()
+    position = function.end()
+    segments = []
+    while True:
+        part, position = _parse_location(spanline, position)
+        segments.extend(part)
+        if spanline.startswith(",", position):
+            position += 1
+        elif spanline.startswith(")", position):
+            position += 1
+            break
+        else:
+            raise ValueError("Unterminated {0}() in location: {1}".format(function.group(1), spanline))
+    if function.group(1) == "complement":
+        # The reverse complement of a join is the join of the reverse
+        # complements, in reverse order.
+        segments = [(start, end, -strand) for start, end, strand in reversed(segments)]
+    elif function.group(1) == "order":
+        # order() gives no joining order, so fetch the whole stretch covered.
+        strands = set(x[2] for x in segments)
+        if len(strands) != 1:
+            raise ValueError("Can't assemble an order() spanning both strands: " + spanline)
+        segments = [(min(x[0] for x in segments), max(x[1] for x in segments), strands.pop())]
+    return segments, position
+
+_transl_except = re.compile(r'pos:(.+),aa:(\w+)')
+# Bases decoded at a time by GenbankFile.extract_sequences from sequences
+# not held as a str, like PackedSequence and MappedSequence.
+extraction_window = 1 << 20
+
+class _OriginBlock(list):
+    '''The ORIGIN block as iter_indent_blocks yields it: a list holding only
+    the "ORIGIN" line, with the bases of the lines that follow cleaned into
+    self.bases as they are read, so the raw lines are never all held.'''
+    def __init__(self, origin_line):
+        list.__init__(self, [origin_line])
+        self.bases = bytearray()
+
+    def add(self, line):
+        'Cleans a sequence line, as nucutils.origin_to_bases does, onto self.bases.'
+        # Non-ASCII characters become "?", to be caught as non-bases by
+        # deduce_alphabet rather than aborting the parse here.
+        self.bases += line.encode("ascii", errors="replace").translate(nucutils.origin_uppercase, nucutils.origin_noise)
+
+def _meta_item(meta_block):
+    'Splits a "foo=bar" meta-line into its cleaned-up (name, content) pair.'
+    # Expected format after GBFeature's processing is 'translation="HSAGHTCNHAT..."'
+    meta_tag_bits = meta_block.split("=")
+    meta_name = meta_tag_bits[0].strip().strip(r'/\"()')
+    # In case content contained "=" symbol and got split, recombine
+    meta_tag_bits = [x.strip().strip(r'"\/()') for x in meta_tag_bits]
+    meta_content = '='.join(meta_tag_bits[1:])
+    if meta_name == "translation":
+        meta_content = ''.join(meta_content.split())
+    return meta_name, meta_content
+
 class GBFeature:
     '''Parser/Container class for genbank feature entries.
     Should be passed a feature block as a list of strings corresponding to lines
     from the feature table, including the "CDS"/"gene"/etc opening word, and a
     GenbankFile object containing the referred-to sequence.
-    This object doesn't initially contain the referred-to sequence, but
-    rather generates it when its "sequence" property is called, and then
-    caches it within the object locally.
+    The range specifier is parsed once, into self.location (see
+    parse_location), so start, end and strand are available without touching
+    the sequence. This object doesn't initially contain the referred-to
+    sequence, but rather generates it when its "sequence" property is called,
+    and then caches it in the GenbankFile's sequence_cache, if it has one.
     This object is compatible with extended IUPAC, and can attempt to give
     reverse complement for any IUPAC-compatible DNA/RNA sequence, but will
     raise an exception if asked to generate the complement of a hybrid between
     RNA and DNA.'''
     # Genbank file format reference: http://www.insdc.org/files/feature_table.html
     # Includes all the horrible dark magic of feature range specifiers.
-    gb_func_finder = re.compile(r'(join|complement|order)(\([0-9<>.,]+\))')
-    # using gb_func_finder.findall(string) on the range expression returns
-    # output like:
-    # [('join', '(12..78,134..202)'), ('complement', '(34..126)')]
-    # ..but only functions surrounding NUMBERS are returned, so this only
-    # resolves the innermost layer of complex expressions like:
-    # complement(join(10..20,100..120))
-    # This is be used to render this into:
-    # complement(GCATTCTAGGCTAGCTATG), which can be parsed further with:
-    gb_func_finder_2 = re.compile(r'(join|complement|order)(\([GATCU]{1,}\))')
 
     def __init__(self, list_of_lines, parent_genbank_object):
         'Should be provided with the feature block split into a list of strings.'
         self._parent_genbank_object = parent_genbank_object
         self.meta = {}
-        self._sequence = ''
-        # This is used as a mapping dict to call the right function on
-        # complex range specifiers when assembling the sequence:
-        self.gb_funcs = {"join":self._gb_join,
-                         "complement":self._gb_complement,
-                         "order":self._gb_order}
-        # This is used as a mapping dict to call the right function on
-        # partially-finished hybrid statements where a function call
-        # now contains a string of DNA rather than the original range:
-        self.hybrid_funcs = {"join":self._join,
-                             "complement":self._complement,
-                             "order":self._order}
+        # Every value of qualifiers given more than once, like db_xref:
+        self.repeated_meta = {}
 
         # Get feature type:
         firstline_bits = list_of_lines[0].strip().split()
@@ -100,33 +178,45 @@ class GBFeature:
 
     def set_span(self, spanline):
         '''This stores the sometimes-simple, sometimes-nightmarish sequence range specifier line.
-        This only does as much as necessary (usually very little) to prepare the span-line for
-        later parsing if the feature's sequence is actually asked for.'''
+        The line is parsed once into self.location, a flat array of
+        (start, end, strand) segments; if it can't be parsed (or refers to
+        another accession), self.location is None and asking for the
+        sequence raises an exception. self.partial_start is set if the
+        feature's 5' end is marked partial ("<" on a forward start, ">" on
+        a complement end), i.e. it doesn't begin on its real start codon.'''
         # Examples of span-lines:
         # (Previously multiline spanlines will be joined by a space)
         # complement(order(4286215..4286223,4286290..4286292, 4286296..4286301,4286596..4286607,4286611..4286613))
         # complement(4289460..4289591)
         # 4278837..4279160
         spanline = spanline.strip().replace(" ","")
+        partial_bounds = set(_partial_bound.findall(spanline))
         if "<" in spanline or ">" in spanline:
             spanline = spanline.replace("<","").replace(">","")
             self.fuzzyboundary = True
         self.spanline = spanline
+        try:
+            self.location = parse_location(spanline)
+        except ValueError:
+            self.location = None
+        # The first segment is the 5' one, whichever strand it's on.
+        self.partial_start = False
+        if self.location is not None:
+            start, end, strand = self.location[:3]
+            if strand == -1:
+                self.partial_start = (">", str(end)) in partial_bounds
+            else:
+                self.partial_start = ("<", str(start+1)) in partial_bounds
 
     def store_meta(self, meta_block):
         'Parses a "foo=bar" meta-line. Completed lines are added to self.meta.'
-        # TODO: Many meta-keys like db_xref may occur many times per feature!
-        # Need to refactor to preserve multiple references, perhaps by converting
-        # all metablock entries to lists and appending?
+        # Many meta-keys like db_xref may occur many times per feature.
+        # self.meta keeps the last value, as it always has; all values of a
+        # repeated key are kept in self.repeated_meta. See meta_values().
         try:
-            # Expected format after above processing is 'translation="HSAGHTCNHAT..."'
-            meta_tag_bits = meta_block.split("=")
-            meta_name = meta_tag_bits[0].strip().strip(r'/\"()')
-            # In case content contained "=" symbol and got split, recombine
-            meta_tag_bits = [x.strip().strip(r'"\/()') for x in meta_tag_bits]
-            meta_content = '='.join(meta_tag_bits[1:])
-            if meta_name == "translation":
-                meta_content = ''.join(meta_content.split())
+            meta_name, meta_content = _meta_item(meta_block)
+            if meta_name in self.meta:
+                self.repeated_meta.setdefault(meta_name, [self.meta[meta_name]]).append(meta_content)
             self.meta[meta_name] = meta_content
         except:
             print(("Error occurred while trying to store following"
@@ -139,150 +229,307 @@ class GBFeature:
         else:
             return self.meta['gene']
 
-    @staticmethod
-    def _nativise(gb_range_expression):
-        '''Renders genbank ranges into Python lists.
-        So this: (x..y,z..w) is converted to: [[x,y],[z,w]].
-        This method expects single parenthetised data only, so nested
-        data will probably choke it.'''
-        outlist = []
-        gb_range_expression = gb_range_expression.strip().strip("()")
-        for subexpression in gb_range_expression.split(","):
-            # We ignore < or >, as they aren't useful for this
-            # parser's intended use.
-            subexpression.strip("<>")
-            # Create a list item for int-coerced ranges, then append to
-            # output list.
-            subexpression = [int(x) for x in subexpression.split("..")]
-            outlist.append([subexpression[0]-1, subexpression[1]])
-        return outlist
-
-    def _join(self, joinrange):
-        '''Join partially-resolved genbank statements like (TTCAG,GAAC)'''
-        joinrange = joinrange.strip().strip("()").split(",")
-        return ''.join(joinrange)
-
-    def _gb_join(self, joinrange):
-        'Given "(x..y,z..w,[a..b]...)", return "GCGATCTGGCATGCT..."'
-        # Convert string-formatted genbank range to list of lists:
-        # output is of form [[x,y],[z,w],[a,b]...]
-        joinrange = self._nativise(joinrange)
-        output_list = []
-        for subrange in joinrange:
-            # subrange = [int, int]
-            # Make a shorter pointer to make code not-ugly:
-            search_seq = self._parent_genbank_object.sequence
-            output_list.append(search_seq[subrange[0]:subrange[1]])
-        return ''.join(output_list)
-
-    def _complement(self, c_string):
-        'Given "(GGCCTTCC)", return "GGAAGGCC".'
-        # No need to split at commas; genbank format should use join() for
-        # compound complements like complement(join(1..3,5..7))
-        c_string = c_string.strip().strip("()")
-        return nucutils.get_complement(c_string)
-
-    def _order(self, o_string):
-        raise NotImplementedError(("Error: Genbank files shouldn't have"
-                    " any reason to include order as an outer function.."))
-
-    def _gb_complement(self, c_range):
-        'Given (x..y), return "GCAGTTACGTGTACTTTACTGGTG"'
-        # Convert string-formatted genbank range to list of lists:
-        c_range = self._nativise(c_range)[0]
-        # Fetch specified sequence range:
-        try: output_sequence = self._parent_genbank_object.sequence[c_range[0]:c_range[1]]
-        except IndexError as e:
-            print("IndexError:",e,"c_range:",c_range,sep="\n")
-        # Get reverse complement:
-        output_sequence = nucutils.get_complement(output_sequence)
-        return output_sequence
-
-    def _gb_order(self, orderrange):
-        'Given (a..b,c..d,e..f), return the range a..f.'
-        orderrange = self._nativise(orderrange)
-        # Just get the start and finish of the range!
-        startbase = orderrange[0][0]
-        finishbase = orderrange[len(orderrange)-1][1]
-        # Sanity check: is start a smaller number than finish?
-        if startbase > finishbase:
-            # What to do now? Should we return the complement?
-            raise NotImplementedError(("Was asked to fetch an ordered"
-                   " range where the start base was larger than the"
-                   " finish base: not sure what to do about this!"))
-        # Now return the sequence spanned by this range..
-        return self._parent_genbank_object.sequence[startbase:finishbase]
-
-    def parse_gb_functions(self, gb_expression):
-        'Do first-round parsing of gb functions like complement(join(1..2,5..6))'
-        # Find first-round functions to address:
-        first_round_functions = self.gb_func_finder.findall(gb_expression)
-        for func_call in first_round_functions:
-            # Format will be ('', (a..b,c..d))
-            func_to_call = self.gb_funcs[func_call[0]]
-            # Replace the original expression with the output.
-            gb_expression = gb_expression.replace(''.join(func_call[0]),func_to_call(func_call[1]))
-        return gb_expression
+    def meta_values(self, meta_name):
+        'Returns a list of every value given for a meta key, in file order.'
+        if meta_name in self.repeated_meta:
+            return list(self.repeated_meta[meta_name])
+        if meta_name in self.meta:
+            return [self.meta[meta_name]]
+        return []
+
+    @property
+    def start(self):
+        'The lowest 0-based position this feature covers, or None if it has no location here.'
+        if self.location:
+            return min(self.location[0::3])
+
+    @property
+    def end(self):
+        'The position just past the highest base this feature covers, or None.'
+        if self.location:
+            return max(self.location[1::3])
+
+    @property
+    def strand(self):
+        'Either 1 or -1 if every segment is on that strand, 0 if mixed, or None.'
+        if self.location:
+            strands = set(self.location[2::3])
+            return strands.pop() if len(strands) == 1 else 0
+
+    def assemble(self, sequence, offset=0, alphabet=None):
+        '''Gathers this feature's segments from sequence and returns them as one string.
+        sequence may be any sliceable holding the genome from position offset
+        onwards. Runs of minus-strand segments are reverse-complemented in a
+        single call rather than segment by segment. If alphabet is given (see
+        nucutils.deduce_alphabet) the segments are taken as already validated.'''
+        location = self.location
+        pieces = []
+        index = 0
+        while index < len(location):
+            strand = location[index+2]
+            run = []
+            while index < len(location) and location[index+2] == strand:
+                run.append(sequence[location[index]-offset:location[index+1]-offset])
+                index += 3
+            if strand < 0:
+                # Reverse complement of the run, forward pieces in reverse order.
+                pieces.append(nucutils.get_complement(''.join(reversed(run)), alphabet))
+            else:
+                pieces.extend(run)
+        return ''.join(pieces)
+
+    def _sequence_offset(self, position):
+        'Returns how far into this feature\'s assembled sequence a genome position falls, or None.'
+        offset = 0
+        for index in range(0, len(self.location), 3):
+            start, end, strand = self.location[index:index+3]
+            if start <= position < end:
+                return offset + (position-start if strand > 0 else end-1-position)
+            offset += end - start
+
+    def translation_exceptions(self, codon_start=1):
+        '''Returns this feature's /transl_except qualifiers as {codon number: amino acid}.
+        Qualifiers look like "(pos:213..215,aa:Sec)" or
+        "(pos:complement(1000..1002),aa:TERM)"; positions are mapped through
+        this feature's location to codons counted from codon_start.'''
+        exceptions = {}
+        for value in self.meta_values("transl_except"):
+            match = _transl_except.search(''.join(value.split()))
+            if not match or not self.location:
+                continue
+            try:
+                position = parse_location(match.group(1))
+            except ValueError:
+                continue
+            # The first base of the codon, reading along the feature:
+            first_base = position[0] if position[2] > 0 else position[1]-1
+            offset = self._sequence_offset(first_base)
+            if offset is not None and offset >= codon_start-1:
+                exceptions[(offset-codon_start+1) // 3] = nucutils.amino_acid_codes.get(match.group(2), "X")
+        return exceptions
+
+    def translate(self, table=None):
+        '''Translates this feature's sequence into amino acids.
+        Uses the feature's /transl_table (unless table is given), /codon_start
+        and /transl_except qualifiers, and follows genbank /translation
+        conventions: an initiator first codon reads "M", unless the feature
+        is 5' partial, and the final stop is dropped. See nucutils.translate.'''
+        if table is None:
+            table = self.meta.get("transl_table", 1)
+        codon_start = int(self.meta.get("codon_start", 1))
+        return nucutils.translate(self.sequence, table, codon_start,
+                                  self.translation_exceptions(codon_start), cds=True,
+                                  partial_start=self.partial_start)
+
+    @property
+    def view(self):
+        '''Returns this feature's sequence as a seqstore.SeqView.
+        For a single-segment location, forward or complemented, the view
+        refers to the parent sequence and slices it only when materialised.
+        Joined locations can't be one window, so their view wraps the
+        assembled sequence.'''
+        if self.location is not None and len(self.location) == 3:
+            start, end, strand = self.location
+            return seqstore.SeqView(self._parent_genbank_object.sequence, start, end, strand)
+        return seqstore.SeqView(self.sequence)
 
     @property
     def sequence(self):
-        if self._sequence:
-            # If the below has been called before, the output will be saved
-            # to self._sequence to spare us the trouble next time:
-            return self._sequence
-        if self.spanline.isnumeric():
-            return self._parent_genbank_object.sequence[int(self.spanline)-1]
-        returnseq = self.spanline
-        # First, check if there's a colon in the span; if so, it's
-        # referring to another sequence accession, which we can't handle
-        if ":" in returnseq:
-            raise NotImplementedError(("This sequence contains a ':'"
-                     " character, indicating a reference to another"
-                     " sequence accession. This isn't yet implemented."))
-        returnseq = returnseq.replace("<","").replace(">","").replace("^","..")
-        # self.spanline contains the sequence location specifier from the GB file.
-        # Parse for order/complement/join blocks using regex
-        first_order_funcs = self.gb_func_finder.findall(self.spanline)
-        # Resolve first-order functions, replacing them with the output.
-        # Should do nothing if no functions are found.
-        if first_order_funcs:
-            for func_call in first_order_funcs:
-                # func_call is of tuple/str format ("join", "(11..45,60..89)")
-                func_resolve_method = self.gb_funcs[func_call[0]]
-                # Resolution methods are written to deal with flanking brackets:
-                replace_content = func_resolve_method(func_call[1])
-                content_to_replace = func_call[0]+func_call[1]
-                returnseq = returnseq.replace(content_to_replace, replace_content)
-            # Parse output for second-order functions using regex.
-            second_order_funcs = self.gb_func_finder_2.findall(returnseq)
-            # Resolve second-order functions, replacing them with the output.
-            # Should do nothing if no second-order calls were found:
-            for func_call in second_order_funcs:
-                func_resolve_method = self.hybrid_funcs[func_call[0]]
-                replace_content = func_resolve_method(func_call[1])
-                content_to_replace = func_call[0]+func_call[1]
-                returnseq = returnseq.replace(content_to_replace,replace_content)
-        else:
-            seq_indices = returnseq.split('.')
-            for x in seq_indices[:]:
-                if not x: seq_indices.pop(seq_indices.index(x))
-            seq_indices = [int(x) for x in seq_indices]
-            # Adjust only first index so string indexing works.
-            seq_indices[0] = seq_indices[0]-1
-            if seq_indices:
-                # Resolve the range ['x','y']
-                try: returnseq = self._parent_genbank_object.sequence[seq_indices[0]:seq_indices[1]]
-                except TypeError as e:
-                    print("TypeError with indices: "+str(seq_indices)+" types: [{0}, {1}]".format(type(seq_indices[0]),type(seq_indices[1])),e, sep="\n")
-        # Check sequence for any remaining non-nucleotide clutter
-        charset = nucutils.deduce_alphabet(returnseq)
-        for char in charset:
-            if char not in nucutils.iupac_characters:
-                raise ValueError("Non-IUPAC character(s) found:"+str(charset))
+        # Resolved sequences are kept in the parent's SequenceCache, if any,
+        # to spare us the trouble next time:
+        cache = self._parent_genbank_object.sequence_cache
+        if cache is not None:
+            cache_key = cache.key(self._parent_genbank_object, self)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+        if self.location is None:
+            # First, check if there's a colon in the span; if so, it's
+            # referring to another sequence accession, which we can't handle
+            if ":" in self.spanline:
+                raise NotImplementedError(("This sequence contains a ':'"
+                         " character, indicating a reference to another"
+                         " sequence accession. This isn't yet implemented."))
+            raise ValueError("Could not parse feature location: " + self.spanline)
+        # A genome that validated as a whole needn't be checked per feature.
+        alphabet = self._parent_genbank_object.sequence_alphabet()
+        returnseq = self.assemble(self._parent_genbank_object.sequence, alphabet=alphabet)
+        if alphabet is None:
+            # Check sequence for any remaining non-nucleotide clutter
+            nucutils.deduce_alphabet(returnseq)
         # Cache and return completed sequence.
-        if self._parent_genbank_object.cache_sequences: self._sequence = returnseq
+        if cache is not None:
+            cache.put(cache_key, returnseq)
         return returnseq
 
+class GBFeatureTable:
+    '''Lazy, list-like table of the features in a genbank file.
+    While the FEATURES block is scanned only each feature's type and line
+    span are recorded; the full GBFeature, with its stripped lines, span
+    and meta dict, is built the first time that feature is accessed and is
+    then kept for later lookups. Iterating over the table builds every
+    feature, so callers that only want some types should use of_type().'''
+    def __init__(self, parent_genbank_object):
+        self._parent_genbank_object = parent_genbank_object
+        # The raw FEATURES blocks, as lists of lines:
+        self._blocks = []
+        # Flat (block number, first line, last line + 1) triples, one per feature:
+        self._spans = array.array('l')
+        # Feature types in file order, available without building features:
+        self.types = []
+        # Built GBFeature objects, or None where not yet accessed:
+        self._features = []
+
+    def add_block(self, features_block_lines):
+        'Scans a FEATURES block, recording the type and line span of each feature.'
+        block_number = len(self._blocks)
+        self._blocks.append(features_block_lines)
+        # The first line is the "FEATURES  Location/Qualifiers" header.
+        start = 1
+        for line_number in range(2, len(features_block_lines)):
+            # Each feature begins on a line indented by five spaces.
+            if GenbankFile._count_indent(features_block_lines[line_number]) == 5:
+                self._add_span(block_number, start, line_number)
+                start = line_number
+        if start < len(features_block_lines):
+            self._add_span(block_number, start, len(features_block_lines))
+
+    def _add_span(self, block_number, start, end):
+        self._spans.extend((block_number, start, end))
+        self.types.append(self._blocks[block_number][start].split(None, 1)[0])
+        self._features.append(None)
+
+    def build_all(self, workers=None):
+        '''Builds every feature not yet built.
+        If workers is more than 1, the unbuilt features are split into chunks
+        at feature boundaries and parsed in a pool of that many processes.
+        Results are merged back in file order and attached to this table's
+        genbank object, so they are identical to those built serially.'''
+        unbuilt = [x for x in range(len(self)) if self._features[x] is None]
+        if not workers or workers < 2 or len(unbuilt) < 2:
+            for index in unbuilt:
+                self._build(index)
+            return
+        # A few chunks per worker keeps the pool busy if chunks run unevenly.
+        chunk_size = -(-len(unbuilt) // (workers * 4))
+        chunks = [unbuilt[x:x+chunk_size] for x in range(0, len(unbuilt), chunk_size)]
+        with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            built_chunks = pool.map(_build_detached_features,
+                                    ([self._feature_lines(x) for x in chunk] for chunk in chunks))
+            for chunk, built in zip(chunks, built_chunks):
+                for index, feature in zip(chunk, built):
+                    feature._parent_genbank_object = self._parent_genbank_object
+                    self._features[index] = feature
+
+    def spanline(self, index):
+        '''Returns the location of the feature at index without building it.
+        This is the raw range specifier as GBFeature.set_span would see it,
+        i.e. "complement(join(10..20,30..40))", with whitespace removed.
+        A built feature gives its own spanline instead, as the raw lines
+        may be gone (see __getstate__).'''
+        feature = self._features[index]
+        if feature is not None:
+            return feature.spanline
+        lines = self._feature_lines(index)
+        location = [lines[0].split(None, 1)[1]]
+        for line in lines[1:]:
+            line = line.strip()
+            if line.startswith("/"):
+                break
+            location.append(line)
+        return ''.join(''.join(location).split())
+
+    def scan_qualifiers(self, *meta_names):
+        '''Yields (index, meta name, value) for the given meta keys of every feature.
+        Unbuilt features are read from their raw lines, skipping every other
+        qualifier, so this is much cheaper than building the features to read
+        their meta dicts; values come out as they would in GBFeature.meta.
+        Repeated qualifiers are yielded once per value, in file order.'''
+        wanted = set(meta_names)
+        for index in range(len(self)):
+            feature = self._features[index]
+            if feature is not None:
+                for meta_name in meta_names:
+                    for value in feature.meta_values(meta_name):
+                        yield index, meta_name, value
+                continue
+            # Qualifier lines, with any continuation lines, as GBFeature joins them:
+            qualifier = None
+            for line in self._feature_lines(index)[1:]:
+                line = line.strip()
+                if line.startswith("/"):
+                    if qualifier:
+                        yield (index,) + _meta_item(' '.join(qualifier))
+                    line = line.lstrip("/")
+                    qualifier = [line] if line.split("=", 1)[0].strip() in wanted else None
+                elif qualifier:
+                    qualifier.append(line)
+            if qualifier:
+                yield (index,) + _meta_item(' '.join(qualifier))
+
+    def _feature_lines(self, index):
+        'Returns a copy of the raw lines of the feature at index.'
+        block_number, start, end = self._spans[index*3:index*3+3]
+        return self._blocks[block_number][start:end]
+
+    def _build(self, index):
+        'Builds, stores and returns the GBFeature at index.'
+        # GBFeature rewrites the list it is given, so it gets a copy.
+        feature = GBFeature(self._feature_lines(index), self._parent_genbank_object)
+        self._features[index] = feature
+        return feature
+
+    def __len__(self):
+        return len(self._features)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        feature = self._features[index]
+        if feature is None:
+            if index < 0:
+                index += len(self)
+            feature = self._build(index)
+        return feature
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return "<GBFeatureTable: {0} features>".format(len(self))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if None not in self._features:
+            # Every feature is built, so the raw lines are no longer needed.
+            state['_blocks'] = []
+        return state
+
+    def of_type(self, *feature_types):
+        'Yields only features of the given types, building no others.'
+        for index, feature_type in enumerate(self.types):
+            if feature_type in feature_types:
+                yield self[index]
+
+def span_bounds(spanline):
+    '''Returns (start, end, strand) for a genbank range specifier, or None.
+    start and end are the 0-based, half-open bounds of everything the
+    location touches, and strand is 1 or -1 if every segment is on that
+    strand, or 0 for anything mixed. None is returned for locations that
+    can't be parsed, including those on other accessions.'''
+    try:
+        location = parse_location(spanline)
+    except ValueError:
+        return None
+    strands = set(location[2::3])
+    return (min(location[0::3]), max(location[1::3]), strands.pop() if len(strands) == 1 else 0)
+
+def _build_detached_features(feature_blocks):
+    '''Builds GBFeatures with no parent genbank object, for GBFeatureTable.build_all.
+    Runs in worker processes; the parent is attached once results return.'''
+    return [GBFeature(lines, None) for lines in feature_blocks]
+
 class GBReference:
     def __init__(self, list_of_lines, parent_genbank_object):
         'Should be provided with a feature block split into a list of strings.'
@@ -367,6 +614,12 @@ class GBReference:
         if self.seqrange:
             return self._parent_genbank_object['Sequence'][self.seqrange[0]:self.seqrange[1]]
 
+    @property
+    def view(self):
+        'As for sequence, but returns a seqstore.SeqView that slices the genome only when used.'
+        if self.seqrange:
+            return seqstore.SeqView(self._parent_genbank_object['Sequence'], self.seqrange[0], self.seqrange[1])
+
     def process_authors(self, line):
         if line[:7] == "AUTHORS":
             line = line[7:].lstrip()
@@ -401,9 +654,23 @@ class GenbankFile(dict):
     '''Parses a genbank-formatted string or file.
     Must be provided either of the "file_contents" or "file_name" arguments.
     file_name should be a path to the target file,
-    file_contents should be a string as if file.read() directly from a file.'''
-    def __init__(self, file_contents=None, file_name=None, cache=True):
-        'Accepts either a genbank filename or contents of same.'
+    file_contents should be a string as if file.read() directly from a file.
+    Alternatively, indent_blocks may be an iterator of blocks as yielded by
+    iter_indent_blocks, in which case only the blocks up to and including
+    the next "//" record separator are consumed; see iter_records.
+    If packed is set, the sequence is stored as a seqstore.PackedSequence
+    at 2 bits per base rather than as a str; slicing it still gives strs.
+    If mapped is set (file_name only), the file is memory-mapped and the
+    sequence is a seqstore.MappedSequence that reads ORIGIN lines from the
+    file only when a slice needs them. Only the first record is read.
+    Features are normally built lazily, on first access. If workers is set,
+    they are all built up front instead, in a pool of that many processes.'''
+    def __init__(self, file_contents=None, file_name=None, cache=True, indent_blocks=None, packed=False, mapped=False, workers=None):
+        '''Accepts either a genbank filename or contents of same.
+        cache sets how resolved feature sequences are kept: True keeps every
+        one, False none, a number keeps the most recently used within that
+        many bases, and a seqstore.SequenceCache is used as given, so one
+        cache can be shared between genomes.'''
         self.block_parsers = {"ORIGIN":self.process_sequence,
                               "FEATURES":self.process_features,
                               "COMMENT":self.process_comment,
@@ -416,6 +683,13 @@ class GenbankFile(dict):
                               "KEYWORDS":self.process_keywords,
                               "LOCUS":self.process_locus,
                               "//":self._ignore}
+        self.packed = packed
+        self.workers = workers
+        # Interval index over feature locations, built by the first features_in call.
+        self.feature_index = None
+        # Complement dict for the whole sequence, set by sequence_alphabet().
+        self.alphabet = None
+        self.alphabet_checked = False
         self['Sequence'] = ''
         self['References'] = []
         self['Accession'] = []
@@ -426,28 +700,60 @@ class GenbankFile(dict):
                             "DBLink":{},
                             "Version":'',
                             "Comment":'',}
-        self["Features"] = []
-        if not file_contents:
+        self["Features"] = GBFeatureTable(self)
+        if indent_blocks is not None:
+            self.process_indent_blocks(indent_blocks, single_record=True)
+        elif not file_contents:
             if not file_name:
                 raise ValueError("Either a genbank filename or a string with genbank-formatted data must be provided.")
             if not isinstance(file_name, str):
                 raise ValueError("Filename must be provided as a string.")
             try:
-                with open(file_name) as Genbank_File:
-                    file_contents = Genbank_File.read()
+                if mapped:
+                    self.map_file(file_name)
+                else:
+                    with open(file_name) as Genbank_File:
+                        # Lines are read straight from the file handle and each
+                        # block is handed to its parser as soon as it ends, so
+                        # only one raw block is ever held in memory.
+                        self.process_indent_blocks(self.iter_indent_blocks(Genbank_File))
             except IOError as e:
                 print("An exception occurred while trying to open file '{0}':".format(file_name), e)
-            self.extract_indent_blocks(file_contents)
-            self.process_indent_blocks()
+        else:
+            self.process_indent_blocks(self.iter_indent_blocks(file_contents.splitlines()))
 
         # Directs subordinate GBFeature objects whether or not they should
         # retain a copy of their parsed/converted sequences in memory. If
-        # set to True, then subsequent lookups will be faster, but at cost
-        # of RAM. Some uses of GenbankFile may call sequence for every object
+        # set, then subsequent lookups will be faster, but at cost of RAM.
+        # Some uses of GenbankFile may call sequence for every object
         # which will incur a processing cost up-front anyway, and in these
         # cases it is a matter of taste whether to preserve future processing
-        # power or RAM.
-        self['cache_sequences'] = cache
+        # power or RAM; a size-bounded cache keeps only the hottest.
+        if isinstance(cache, seqstore.SequenceCache):
+            self.sequence_cache = cache
+        elif cache is True:
+            self.sequence_cache = seqstore.SequenceCache(budget=None)
+        elif cache:
+            self.sequence_cache = seqstore.SequenceCache(budget=cache)
+        else:
+            self.sequence_cache = None
+        self['cache_sequences'] = self.sequence_cache is not None
+
+    def map_file(self, file_name):
+        '''Parses a genbank file through a memory map, indexing rather than reading its sequence.
+        Everything up to ORIGIN is streamed through the usual block parsers;
+        self['Sequence'] then becomes a MappedSequence over the ORIGIN lines.'''
+        with open(file_name, "rb") as Genbank_File:
+            # The map stays valid after the file itself is closed.
+            genbank_map = mmap.mmap(Genbank_File.fileno(), 0, access=mmap.ACCESS_READ)
+        def header_lines():
+            for line in iter(genbank_map.readline, b""):
+                if line.startswith(b"ORIGIN"):
+                    return
+                yield line.decode()
+        self.process_indent_blocks(self.iter_indent_blocks(header_lines()))
+        # The header generator is exhausted, so the map sits just past ORIGIN.
+        self['Sequence'] = seqstore.MappedSequence(genbank_map, genbank_map.tell())
 
     def process_version(self, version_strings):
         'Saves version to self.metadata["Version"].'
@@ -522,26 +828,43 @@ class GenbankFile(dict):
     def extract_indent_blocks(self, gbfile_contents):
         'Parses a genbank file and extracts indented blocks into class properties.'
         gb_lines = gbfile_contents.strip().splitlines()
-        self.indent_blocks = []
+        self.indent_blocks = list(self.iter_indent_blocks(gb_lines))
+
+    @staticmethod
+    def iter_indent_blocks(gb_lines):
+        '''Divides an iterable of genbank lines into indented blocks.
+        Each block is yielded as a list of lines as soon as the next
+        unindented line is seen, so gb_lines may be an open file handle
+        and nothing beyond the current block needs to be kept in memory.
+        The ORIGIN block is the exception: its lines are decoded into bases
+        as they arrive, and it is yielded as an _OriginBlock.'''
         this_block = []
-        # This for/if construct divides a genbank file into indented blocks:
         for line in gb_lines:
-            if not line:
-                continue
+            # Lines read from a file handle still carry their newline.
+            line = line.rstrip("\r\n")
             if not line.strip():
                 # Skip empty lines
                 continue
-            if line[0] != " " and this_block:
-                # Add the list of lines to the list of sub-blocks.
-                self.indent_blocks.append(this_block)
-                this_block = []
-            this_block.append(line)
+            if line[0] != " ":
+                if this_block:
+                    yield this_block
+                this_block = _OriginBlock(line) if line.startswith("ORIGIN") else [line]
+            elif isinstance(this_block, _OriginBlock):
+                this_block.add(line)
+            else:
+                this_block.append(line)
         if this_block:
-            self.indent_blocks.append(this_block)
+            yield this_block
 
-    def process_indent_blocks(self):
-        'Processes each indented block of a Genbank file with a sub-parser.'
-        for block in self.indent_blocks:
+    def process_indent_blocks(self, indent_blocks=None, single_record=False):
+        '''Processes each indented block of a Genbank file with a sub-parser.
+        indent_blocks may be any iterable of blocks, such as the generator
+        returned by iter_indent_blocks; by default self.indent_blocks is used.
+        If single_record is set, processing stops after the first "//"
+        block, leaving any later records in indent_blocks unconsumed.'''
+        if indent_blocks is None:
+            indent_blocks = self.indent_blocks
+        for block in indent_blocks:
             # Remember: each "block" is a *list* of lines from that block.
             # Detect first word of first block line
             firstword = block[0].split()[0].strip().upper()
@@ -552,46 +875,167 @@ class GenbankFile(dict):
             except KeyError: # No parser defined for this block
                 print("No parser found for block '{0}'.".format(firstword))
                 continue
+            if single_record and firstword == "//":
+                break
             # Done! Sub-parsers are written to add output to self.data_blocks.
 
     def process_sequence(self, origin_block_lines):
         'Expects the sequence from the end of a Genbank file, from "ORIGIN" onwards.'
-        # Rather than doing string contatenation (i.e. 'this' =+ 'that'),
-        # we build a list of substrings and then ''.join(list) them, as this
-        # is far faster and memory efficient.
-        output = []
-        for line in origin_block_lines:
-            if not line.strip():
-                # Ignore empty lines.
+        if isinstance(origin_block_lines, _OriginBlock):
+            # Already decoded line by line, as it was read.
+            sequence = origin_block_lines.bases.decode("ascii")
+        else:
+            # Skip the "ORIGIN" line. The "//" end of record indicator is
+            # unindented, so it arrives as its own block and is never seen here.
+            if origin_block_lines and origin_block_lines[0].startswith("ORIGIN"):
+                origin_block_lines = origin_block_lines[1:]
+            # The whole region is joined and decoded in one bytes.translate
+            # pass, which strips numbering and whitespace and uppercases the
+            # bases at C speed. Non-ASCII characters become "?", as in
+            # _OriginBlock.add.
+            sequence = nucutils.origin_to_bases("\n".join(origin_block_lines).encode("ascii", errors="replace"))
+        if self.packed:
+            self['Sequence'] = seqstore.PackedSequence(sequence)
+        else:
+            self['Sequence'] = sequence
+        self.alphabet_checked = False
+
+    def process_features(self, features_block_lines):
+        '''Parses through features block to extract genes, CDS, mRNA etc.
+        Features are only indexed here; each GBFeature is built by the
+        feature table the first time it is accessed, unless self.workers
+        asks for them all to be built now in parallel.'''
+        self['Features'].add_block(features_block_lines)
+        self.feature_index = None
+        if self.workers:
+            self['Features'].build_all(self.workers)
+
+    def sequence_alphabet(self):
+        '''Validates the whole sequence once and returns its complement dict.
+        The result is kept, so features cut from this sequence can skip their
+        own validation. Returns None if the sequence doesn't validate as a
+        whole (or isn't held as a str), in which case features must still be
+        checked individually.'''
+        if not self.alphabet_checked:
+            self.alphabet_checked = True
+            self.alphabet = None
+            if isinstance(self['Sequence'], str):
+                try:
+                    self.alphabet = nucutils.deduce_alphabet(self['Sequence'])
+                except ValueError:
+                    pass
+        return self.alphabet
+
+    def as_array(self):
+        '''Returns the sequence as a seqarray.GenomeArray, for window statistics.
+        Requires numpy. The array is built afresh on each call, so keep it.'''
+        return seqarray.GenomeArray(self['Sequence'])
+
+    def extract_sequences(self, types=None):
+        '''Yields (feature, sequence) for every feature, or those of the given types.
+        Features are sorted by start and resolved in one forward pass over
+        the genome. A sequence not held as a str is decoded a window at a
+        time (see extraction_window) rather than once per feature, and each
+        window, or the whole genome, is validated once rather than each
+        feature's bases. Sequences go through the genome's sequence_cache
+        as for GBFeature.sequence. Features that can't be resolved here (on other
+        accessions, unparseable, or with non-nucleotide bases) are yielded
+        with None, those without a location after all the rest.'''
+        if types is None:
+            features = list(self['Features'])
+        else:
+            features = list(self['Features'].of_type(*types))
+        sequence = self['Sequence']
+        cache = self.sequence_cache
+        if isinstance(sequence, str):
+            window, window_start, window_end = sequence, 0, len(sequence)
+            window_alphabet = self.sequence_alphabet()
+        else:
+            # Empty, so the first feature decodes its own window.
+            window, window_start, window_end = "", 0, -1
+            window_alphabet = None
+        for feature in sorted((x for x in features if x.location), key=lambda x: x.start):
+            cache_key = cache.key(self, feature) if cache is not None else None
+            cached = cache.get(cache_key) if cache is not None else None
+            if cached is not None:
+                yield feature, cached
                 continue
-            elif line.strip() == "//":
-                # Stop processing at end of file indicator.
-                break
-            elif line.strip() == "ORIGIN":
-                # Skip the "ORIGIN" line.
+            start, end = feature.start, feature.end
+            if not isinstance(sequence, str) and (start < window_start or end > window_end):
+                window_start = start
+                window = sequence[start:max(end, start + extraction_window)]
+                window_end = start + len(window)
+                try:
+                    window_alphabet = nucutils.deduce_alphabet(window)
+                except ValueError:
+                    window_alphabet = None
+            try:
+                bases = feature.assemble(window, window_start, window_alphabet)
+                if window_alphabet is None:
+                    nucutils.deduce_alphabet(bases)
+            except ValueError:
+                yield feature, None
                 continue
-            else:
-                # Append a line to the output list, minus any nucleotide-numbers or whitespace.
-                line_content = line.strip().strip("1234567890").replace(" ", "")
-                output.append(line_content.upper())
-        self['Sequence'] = ''.join(output)
+            if cache is not None:
+                cache.put(cache_key, bases)
+            yield feature, bases
+        for feature in features:
+            if not feature.location:
+                yield feature, None
 
-    def process_features(self, features_block_lines):
-        'Parses through features block to extract genes, CDS, mRNA etc.'
-        def addfeature(new_feature):
-            NewFeature = GBFeature(this_feature, self)
-            self['Features'].append(NewFeature)
-        this_feature = []
-        for line in features_block_lines[1:]:
-            indent_lvl = self._count_indent(line)
-            if indent_lvl == 5:
-                # Subsections should be at this indent
-                if this_feature:
-                    addfeature(this_feature)
-                    this_feature = []
-            this_feature.append(line)
-        if this_feature:
-            addfeature(this_feature)
+    def kmer_index(self, k=12, path=None):
+        '''Returns a seqindex.KmerIndex of the sequence's k-mers (requires numpy).
+        If path is given the index is loaded from there when a current one
+        was saved there, and saved there otherwise; see seqindex.open_index.'''
+        return seqindex.open_index(self['Sequence'], path, k=k)
+
+    def translations(self):
+        '''Yields (feature, amino acids) for every CDS feature, translated from the sequence.
+        Each CDS is translated with its own qualifiers; see GBFeature.translate.
+        CDSs whose sequence can't be resolved here (for example, those on
+        other accessions) are yielded with None rather than stopping the run.'''
+        # Check the genome's alphabet once up front, not once per CDS.
+        self.sequence_alphabet()
+        for feature in self['Features'].of_type("CDS"):
+            try:
+                yield feature, feature.translate()
+            except (ValueError, NotImplementedError):
+                yield feature, None
+
+    def build_feature_index(self):
+        '''Builds the interval index used by features_in.
+        Locations come from GBFeatureTable.spanline, so no GBFeature
+        needs to be built to index it.'''
+        table = self['Features']
+        located = []
+        for index in range(len(table)):
+            bounds = span_bounds(table.spanline(index))
+            if bounds:
+                located.append((bounds[0], bounds[1], (index, bounds[2])))
+        self.feature_index = intervals.IntervalIndex(located)
+
+    def features_in(self, start, end, strand=None, types=None):
+        '''Returns the features overlapping sequence positions start to end.
+        Positions are 0-based and half-open, as when slicing self['Sequence'].
+        strand may be 1 (or "+") or -1 (or "-") to keep only features wholly
+        on that strand, and types may be an iterable of feature types such
+        as ("gene", "CDS"). Features are returned in order of start position.
+        The first call indexes every feature location; later calls cost time
+        logarithmic in the number of features for each feature returned.'''
+        if self.feature_index is None:
+            self.build_feature_index()
+        strand = {"+": 1, "-": -1}.get(strand, strand)
+        if types is not None:
+            types = set(types)
+        table = self['Features']
+        found = []
+        for index, feature_strand in self.feature_index.overlapping(start, end):
+            if strand is not None and feature_strand != strand:
+                continue
+            if types is not None and table.types[index] not in types:
+                continue
+            found.append(table[index])
+        return found
 
     def process_reference(self, reference_strings):
         'Parse a reference block and append to list.'
@@ -609,17 +1053,27 @@ class GenbankFile(dict):
         else:
             raise AttributeError("Attribute {0} neither in object namespace nor in genbank object dictionary.".format(attribute))
 
+def iter_records(file_name, cache=True, packed=False, workers=None):
+    '''Yields one GenbankFile per "//"-terminated record in a genbank file.
+    The file is read lazily and each record is parsed only when requested,
+    so no more than one record is held in memory at a time.'''
+    with open(file_name) as Genbank_File:
+        blocks = GenbankFile.iter_indent_blocks(Genbank_File)
+        for first_block in blocks:
+            # The record consumes blocks from the shared generator up to its
+            # own "//", so the next iteration starts on the following record.
+            yield GenbankFile(indent_blocks=itertools.chain([first_block], blocks), cache=cache, packed=packed, workers=workers)
+
 def testfeatures(gb_obj):
     errors = []
     feature_types = []
     meta_keys = []
     excessive_meta_features = []
-    for feature in gb_obj.features:
-        try:
-            x = feature.sequence
-        except:
+    for feature, sequence in gb_obj.extract_sequences():
+        if sequence is None:
             errors.append(feature)
             print("Error found in feature:",feature.type,feature.spanline)
+    for feature in gb_obj.features:
         if feature.type not in feature_types:
             feature_types.append(feature.type)
         for key in feature.meta.keys():
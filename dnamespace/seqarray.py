@@ -0,0 +1,104 @@
+'''seqarray - NumPy arrays over genome sequences, for whole-genome statistics.
+by Cathal Garvey
+Part of the DNAmespace project. License accessible as seqarray.license.
+
+GenomeArray holds a sequence as one uint8 code per base, using the IUPAC
+alphabet in nucutils, and computes sliding-window statistics (GC content,
+GC skew, base composition) and N runs with cumulative sums, so each costs
+a few passes over the array however large the window is.
+numpy is optional for the rest of DNAmespace: this module imports without
+it, but building a GenomeArray raises ImportError.
+'''
+from dnamespace import nucutils
+from dnamespace.gnulicenses import Affero as license
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Each IUPAC character is coded as its position in nucutils.iupac_characters,
+# in either case; any other byte becomes unknown_code.
+unknown_code = len(nucutils.iupac_characters)
+_code_table = bytearray([unknown_code]) * 256
+for code, character in enumerate(nucutils.iupac_characters):
+    _code_table[ord(character)] = code
+    _code_table[ord(character.lower())] = code
+_code_table = bytes(_code_table)
+# Bases counted as G or C by gc_content: S is "G or C" too.
+gc_bases = "GCS"
+
+def base_code(character):
+    'Returns the uint8 code used for a base.'
+    return _code_table[ord(character)]
+
+class GenomeArray:
+    '''A genome sequence as a numpy uint8 array of IUPAC codes.
+    Accepts a str, bytes or any of the seqstore sequences. Window statistics
+    cover every window of the given size starting at 0, step, 2*step, ...
+    that fits in the sequence; window_starts() gives those positions.'''
+    def __init__(self, sequence):
+        if numpy is None:
+            raise ImportError("GenomeArray requires numpy.")
+        if not isinstance(sequence, (bytes, bytearray)):
+            sequence = str(sequence).encode("ascii")
+        self.codes = numpy.frombuffer(bytes(sequence).translate(_code_table), dtype=numpy.uint8)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __str__(self):
+        alphabet = numpy.frombuffer((''.join(nucutils.iupac_characters) + "?").encode(), dtype=numpy.uint8)
+        return alphabet[self.codes].tobytes().decode("ascii")
+
+    def __repr__(self):
+        return "<GenomeArray: {0} bases>".format(len(self))
+
+    def mask(self, bases):
+        'Returns a boolean array marking every position holding one of bases.'
+        return numpy.isin(self.codes, [base_code(x) for x in bases])
+
+    def counts(self):
+        'Returns the number of each IUPAC character in the sequence, as a dict of non-zero counts.'
+        totals = numpy.bincount(self.codes, minlength=unknown_code+1)
+        return {character: int(totals[code]) for code, character in enumerate(nucutils.iupac_characters) if totals[code]}
+
+    def window_starts(self, window, step=1):
+        'Returns the start position of every window, as used by the window statistics.'
+        if window < 1 or step < 1:
+            raise ValueError("Window and step must be positive.")
+        return numpy.arange(0, len(self) - window + 1, step)
+
+    def window_counts(self, bases, window, step=1):
+        '''Returns how many of bases fall in each window, as an int64 array.
+        Uses a running total of the base mask: each window's count is the
+        difference of two totals, so the cost doesn't depend on window size.'''
+        starts = self.window_starts(window, step)
+        totals = numpy.zeros(len(self) + 1, dtype=numpy.int64)
+        numpy.cumsum(self.mask(bases), out=totals[1:])
+        return totals[starts + window] - totals[starts]
+
+    def base_composition(self, window, step=1, bases="ACGTN"):
+        'Returns {base: array of its count in each window} for each of bases.'
+        return {base: self.window_counts(base, window, step) for base in bases}
+
+    def gc_content(self, window, step=1):
+        'Returns the fraction of G, C or S bases in each window, as a float array.'
+        return self.window_counts(gc_bases, window, step) / window
+
+    def gc_skew(self, window, step=1):
+        '''Returns (G-C)/(G+C) for each window, as a float array.
+        Windows without any G or C have a skew of 0.'''
+        g = self.window_counts("G", window, step)
+        c = self.window_counts("C", window, step)
+        total = g + c
+        skew = numpy.zeros(len(total))
+        numpy.divide(g - c, total, out=skew, where=total > 0)
+        return skew
+
+    def n_runs(self, min_length=1, bases="N"):
+        '''Returns the runs of N (or any of bases) as an array of (start, end) rows.
+        Runs are half-open, as in slicing, and shorter ones than min_length
+        are left out.'''
+        edges = numpy.diff(self.mask(bases).astype(numpy.int8), prepend=0, append=0)
+        runs = numpy.column_stack((numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)))
+        return runs[runs[:, 1] - runs[:, 0] >= min_length]
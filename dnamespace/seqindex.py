@@ -0,0 +1,369 @@
+'''seqindex - Suffix array and k-mer indexes for searching genome sequences.
+by Cathal Garvey
+Part of the DNAmespace project. License accessible as seqindex.license.
+
+SuffixIndex sorts every suffix of a genome once, after which any pattern is
+found on both strands by binary search: a query costs time logarithmic in
+the genome length, rather than a scan of the whole sequence. Patterns may
+use IUPAC ambiguity codes, which match any of the bases they stand for.
+KmerIndex maps every k-mer of a genome (k from 8 to 32) to its positions,
+for seeding similarity searches and checking primers for off-targets.
+Either can be saved beside its genome and memory-mapped back in; the file
+records a checksum of the sequence so a stale index is never used.
+Building, saving and loading an index require numpy.
+'''
+from dnamespace import nucutils
+from dnamespace.gnulicenses import Affero as license
+try:
+    import numpy
+except ImportError:
+    numpy = None
+import bisect
+import hashlib
+import re
+import struct
+
+# Index files hold the magic, the SHA-1 of the sequence, the byte width of
+# each suffix position, then the suffix array itself.
+index_magic = b"DNAMSFX2"
+index_suffix = ".sfx"
+_index_header = struct.Struct("<8s20sI")
+# K-mer index files hold the magic, the SHA-1 of the sequence, k, the byte
+# width of each position, the number of distinct k-mers and of positions,
+# then the sorted k-mer codes, the offset of each one's positions, and the
+# positions themselves. The header is padded so the arrays stay aligned.
+kmer_index_magic = b"DNAMKMR1"
+kmer_index_suffix = ".kmers"
+_kmer_index_header = struct.Struct("<8s20sIIQQ4x")
+kmer_sizes = range(8, 33)
+# Translates bases to 2-bit k-mer codes in seqstore.packed_bases order
+# (A, C, G, T; U reads as T); anything else becomes 4, which no k-mer holds.
+_kmer_codes = bytearray([4]) * 256
+for _code, _base in enumerate("ACGT"):
+    _kmer_codes[ord(_base)] = _code
+_kmer_codes[ord("U")] = 3
+_kmer_codes = bytes(_kmer_codes)
+# Runs of plain bases are searched in one step; anything else is searched
+# one character at a time, branching over the bases it stands for.
+_pattern_pieces = re.compile(r'[ACGT]+|.', re.DOTALL)
+
+def suffix_array(text):
+    '''Returns the start of every suffix of text (bytes), in sorted order, as a numpy array.
+    Uses prefix doubling: suffixes are ranked by their first k characters,
+    then ranked by pairs of those ranks to order them by their first 2k,
+    until every rank is distinct. Each round is one numpy sort, so a
+    bacterial genome takes seconds.'''
+    if numpy is None:
+        raise ImportError("Building a suffix index requires numpy.")
+    length = len(text)
+    dtype = numpy.int32 if length < 2**31 else numpy.int64
+    if not length:
+        return numpy.zeros(0, dtype=dtype)
+    # Ranks must stay below length + 1 for the keys below to be distinct,
+    # so the first round ranks each byte among those present, not by value.
+    rank = numpy.unique(numpy.frombuffer(text, dtype=numpy.uint8), return_inverse=True)[1].astype(numpy.int64)
+    width = 1
+    while True:
+        # A suffix too short to have a second half sorts before any that do.
+        second = numpy.zeros(length, dtype=numpy.int64)
+        second[:max(0, length-width)] = rank[width:] + 1
+        keys = rank * (length + 1) + second
+        suffixes = numpy.argsort(keys, kind="stable")
+        sorted_keys = keys[suffixes]
+        rank = numpy.empty(length, dtype=numpy.int64)
+        rank[suffixes] = numpy.concatenate(([0], numpy.cumsum(sorted_keys[1:] != sorted_keys[:-1])))
+        if rank[suffixes[-1]] == length - 1 or width >= length:
+            return suffixes.astype(dtype)
+        width *= 2
+
+def encode_kmer(kmer):
+    '''Returns the packed integer code for a k-mer: 2 bits per base, first base highest.
+    Raises ValueError if the k-mer holds anything but A, C, G, T or U.'''
+    codes = kmer.upper().encode("ascii").translate(_kmer_codes)
+    if 4 in codes:
+        raise ValueError("K-mers can only hold unambiguous bases: {0!r}".format(kmer))
+    code = 0
+    for base_code in codes:
+        code = (code << 2) | base_code
+    return code
+
+def decode_kmer(code, k):
+    'Returns the bases of a packed k-mer code, as a str of length k.'
+    return ''.join("ACGT"[(int(code) >> 2*x) & 3] for x in range(k-1, -1, -1))
+
+def _sequence_bytes(sequence):
+    'Returns a sequence (str, bytes or a seqstore sequence) as uppercase bytes.'
+    if isinstance(sequence, (bytes, bytearray)):
+        return bytes(sequence).upper()
+    return str(sequence).upper().encode("ascii")
+
+class SuffixIndex:
+    '''Suffix array over a genome sequence, for finding patterns on both strands.
+    Should be given the sequence, and optionally its already-built suffix
+    array (see load()); otherwise the array is built here. Hits are reported
+    as (start, end, strand) tuples in forward-strand coordinates, half-open
+    as in slicing, with strand 1 or -1; a palindromic site such as GAATTC is
+    reported once on each strand.'''
+    def __init__(self, sequence, suffixes=None):
+        self._text = _sequence_bytes(sequence)
+        self.checksum = hashlib.sha1(self._text).digest()
+        if suffixes is None:
+            suffixes = suffix_array(self._text)
+        self.suffixes = suffixes
+
+    def __len__(self):
+        return len(self._text)
+
+    def __repr__(self):
+        return "<SuffixIndex: {0} bases>".format(len(self))
+
+    def _narrow(self, first, last, depth, literal):
+        'Narrows suffixes[first:last], which share depth characters, to those continuing with literal.'
+        key = lambda position: self._text[position+depth:position+depth+len(literal)]
+        first = bisect.bisect_left(self.suffixes, literal, first, last, key=key)
+        last = bisect.bisect_right(self.suffixes, literal, first, last, key=key)
+        return first, last
+
+    def _ranges(self, pattern):
+        'Returns the (first, last) ranges of the suffix array that begin with pattern.'
+        ranges = [(0, len(self.suffixes))]
+        depth = 0
+        for piece in _pattern_pieces.findall(pattern):
+            if len(piece) > 1:
+                literals = [piece.encode("ascii")]
+            else:
+                literals = [x.encode("ascii") for x in nucutils.iupac_expansions[piece]]
+            narrowed = []
+            for first, last in ranges:
+                for literal in literals:
+                    first_hit, last_hit = self._narrow(first, last, depth, literal)
+                    if first_hit < last_hit:
+                        narrowed.append((first_hit, last_hit))
+            ranges = narrowed
+            depth += len(piece)
+            if not ranges:
+                break
+        return ranges
+
+    def _positions(self, pattern):
+        'Returns the sorted forward-strand start of every occurrence of an uppercase DNA pattern.'
+        hits = [self.suffixes[first:last] for first, last in self._ranges(pattern)]
+        if not hits:
+            return []
+        return sorted(numpy.concatenate(hits).tolist())
+
+    def find_all(self, pattern):
+        '''Returns (start, end, strand) for every occurrence of pattern on either strand.
+        Hits are sorted by start, forward strand first. Raises ValueError if
+        the pattern holds anything but IUPAC bases.'''
+        pattern = pattern.upper().replace("U", "T")
+        if not pattern or set(pattern) - set(nucutils.iupac_expansions):
+            raise ValueError("Search patterns must be IUPAC nucleotides: {0!r}".format(pattern))
+        reverse_pattern = nucutils.get_complement(pattern, nucutils.dnaiupaccomplement)
+        hits = [(x, x+len(pattern), 1) for x in self._positions(pattern)]
+        hits.extend((x, x+len(pattern), -1) for x in self._positions(reverse_pattern))
+        return sorted(hits, key=lambda hit: (hit[0], -hit[2]))
+
+    def count(self, pattern):
+        'Returns the number of occurrences of pattern on both strands; 1 means an oligo is unique.'
+        return len(self.find_all(pattern))
+
+    def save(self, path):
+        'Writes the index to path, to be read back with load().'
+        with open(path, "wb") as Index_File:
+            Index_File.write(_index_header.pack(index_magic, self.checksum, self.suffixes.itemsize))
+            Index_File.write(numpy.ascontiguousarray(self.suffixes).tobytes())
+
+class KmerIndex:
+    '''Maps every k-mer of a genome sequence to the positions it occurs at.
+    Should be given the sequence and k (8 to 32). K-mers are packed 2 bits
+    per base into 64-bit codes, and held in three flat arrays: the distinct
+    codes in sorted order, the offset of each code's run of positions, and
+    all the positions grouped by code, each run in ascending order. A
+    lookup is a binary search of the codes. Windows holding anything but
+    A, C, G and T (such as runs of N) are left out. Positions are 0-based
+    starts on the forward strand; see find_all() for both strands.'''
+    def __init__(self, sequence, k=12, arrays=None):
+        if k not in kmer_sizes:
+            raise ValueError("k must be from {0} to {1}.".format(kmer_sizes[0], kmer_sizes[-1]))
+        self.k = k
+        self._text = _sequence_bytes(sequence)
+        self.checksum = hashlib.sha1(self._text).digest()
+        if arrays is None:
+            arrays = self._build()
+        self.kmers, self.offsets, self.positions = arrays
+
+    def _build(self):
+        'Returns the (kmers, offsets, positions) arrays for the sequence.'
+        if numpy is None:
+            raise ImportError("Building a k-mer index requires numpy.")
+        codes = numpy.frombuffer(self._text.translate(_kmer_codes), dtype=numpy.uint8)
+        windows = max(0, len(codes) - self.k + 1)
+        # Shift each base into every window holding it: k numpy passes.
+        kmers = numpy.zeros(windows, dtype=numpy.uint64)
+        for offset in range(self.k):
+            kmers <<= numpy.uint64(2)
+            kmers |= (codes[offset:offset+windows] & 3).astype(numpy.uint64)
+        # A window is usable if it holds no unpackable base.
+        unpackable = numpy.zeros(len(codes) + 1, dtype=numpy.int64)
+        numpy.cumsum(codes == 4, out=unpackable[1:])
+        positions = numpy.flatnonzero(unpackable[self.k:self.k+windows] == unpackable[:windows])
+        position_type = numpy.uint32 if len(codes) < 2**32 else numpy.int64
+        positions = positions[numpy.argsort(kmers[positions], kind="stable")].astype(position_type)
+        sorted_kmers = kmers[positions]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], sorted_kmers[1:] != sorted_kmers[:-1])))
+        offsets = numpy.append(starts, len(positions)).astype(numpy.int64)
+        return sorted_kmers[starts], offsets, positions
+
+    def __len__(self):
+        'Returns the number of distinct k-mers.'
+        return len(self.kmers)
+
+    def __repr__(self):
+        return "<KmerIndex: k={0}, {1} k-mers over {2} bases>".format(self.k, len(self), len(self._text))
+
+    def _lookup(self, code):
+        'Returns the positions array for a packed k-mer code, empty if it never occurs.'
+        found = int(numpy.searchsorted(self.kmers, numpy.uint64(code)))
+        if found < len(self.kmers) and int(self.kmers[found]) == code:
+            return self.positions[self.offsets[found]:self.offsets[found+1]]
+        return self.positions[0:0]
+
+    def find(self, kmer):
+        'Returns the sorted forward-strand start of every occurrence of a k-mer, as a list.'
+        if len(kmer) != self.k:
+            raise ValueError("This index holds {0}-mers, not {1}-mers.".format(self.k, len(kmer)))
+        return self._lookup(encode_kmer(kmer)).tolist()
+
+    def find_all(self, kmer):
+        '''Returns (start, end, strand) for every occurrence of a k-mer on either strand.
+        Hits are sorted by start, forward strand first, as for SuffixIndex.'''
+        reverse_kmer = nucutils.get_complement(kmer.upper().replace("U", "T"), nucutils.dnacomplement)
+        hits = [(x, x+self.k, 1) for x in self.find(kmer)]
+        hits.extend((x, x+self.k, -1) for x in self.find(reverse_kmer))
+        return sorted(hits, key=lambda hit: (hit[0], -hit[2]))
+
+    def count(self, kmer):
+        'Returns the number of occurrences of a k-mer on both strands.'
+        return len(self.find_all(kmer))
+
+    def seeds(self, query):
+        '''Returns (query offset, start, strand) for every k-mer of query found in the genome.
+        These are the seeds a similarity search extends from: start is the
+        forward-strand start of the matching genome k-mer. K-mers of the
+        query holding anything but A, C, G, T or U are skipped.'''
+        query = query.upper()
+        found = []
+        for query_offset in range(len(query) - self.k + 1):
+            kmer = query[query_offset:query_offset+self.k]
+            try:
+                found.extend((query_offset, start, strand) for start, end, strand in self.find_all(kmer))
+            except ValueError:
+                continue
+        return found
+
+    def save(self, path):
+        'Writes the index to path, to be read back with load().'
+        with open(path, "wb") as Index_File:
+            Index_File.write(_kmer_index_header.pack(kmer_index_magic, self.checksum, self.k,
+                                                     self.positions.itemsize, len(self.kmers), len(self.positions)))
+            for array in (self.kmers, self.offsets, self.positions):
+                Index_File.write(numpy.ascontiguousarray(array).tobytes())
+
+def index_path(gb_file, k=None):
+    '''Returns where an index for a genbank file is kept: beside it, with
+    index_suffix added, or for a k-mer index "<k>" and kmer_index_suffix.'''
+    if k is not None:
+        return "{0}.{1}{2}".format(gb_file, k, kmer_index_suffix)
+    return gb_file + index_suffix
+
+def _load_suffixes(path, text, header):
+    magic, checksum, itemsize = _index_header.unpack(header[:_index_header.size])
+    if itemsize not in (4, 8):
+        return None
+    dtype = numpy.int32 if itemsize == 4 else numpy.int64
+    if len(text):
+        suffixes = numpy.memmap(path, dtype=dtype, mode="r", offset=_index_header.size, shape=(len(text),))
+    else:
+        suffixes = numpy.zeros(0, dtype=dtype)
+    return SuffixIndex(text, suffixes)
+
+def _load_kmers(path, text, header):
+    magic, checksum, k, itemsize, kmer_count, position_count = _kmer_index_header.unpack(header)
+    if itemsize not in (4, 8) or k not in kmer_sizes:
+        return None
+    arrays = []
+    offset = _kmer_index_header.size
+    for dtype, length in ((numpy.uint64, kmer_count), (numpy.int64, kmer_count+1),
+                          (numpy.uint32 if itemsize == 4 else numpy.int64, position_count)):
+        if length:
+            arrays.append(numpy.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(length,)))
+        else:
+            arrays.append(numpy.zeros(0, dtype=dtype))
+        offset += length * numpy.dtype(dtype).itemsize
+    return KmerIndex(text, k, arrays)
+
+def load(path, sequence):
+    '''Returns the SuffixIndex or KmerIndex saved at path, or None if there
+    is none or it was made from a different sequence. The index arrays are
+    memory-mapped rather than read in.'''
+    if numpy is None:
+        raise ImportError("Loading an index requires numpy.")
+    try:
+        with open(path, "rb") as Index_File:
+            header = Index_File.read(_kmer_index_header.size)
+    except IOError:
+        return None
+    text = _sequence_bytes(sequence)
+    # Both headers begin with the magic and then the sequence checksum:
+    if header[8:28] != hashlib.sha1(text).digest():
+        return None
+    try:
+        if header[:8] == index_magic:
+            return _load_suffixes(path, text, header)
+        if header[:8] == kmer_index_magic:
+            return _load_kmers(path, text, header)
+    except (struct.error, ValueError):
+        # Truncated files fail to unpack or to map.
+        pass
+    return None
+
+def open_index(sequence, path=None, k=None):
+    '''Returns a SuffixIndex for sequence, or a KmerIndex if k is given.
+    It is loaded from path if a current one is saved there, or else built
+    and (if path is given) saved there. An index that can't be written out
+    is still returned.'''
+    index = load(path, sequence) if path else None
+    if k is not None and not (isinstance(index, KmerIndex) and index.k == k):
+        index = None
+    if k is None and not isinstance(index, SuffixIndex):
+        index = None
+    if index is None:
+        index = SuffixIndex(sequence) if k is None else KmerIndex(sequence, k)
+        if path:
+            try:
+                index.save(path)
+            except IOError:
+                pass
+    return index
+
+def tests(trials=2000, max_length=41):
+    'Checks suffix_array and SuffixIndex.find_all against naive searches of short random sequences.'
+    import random
+    randomiser = random.Random(0)
+    for trial in range(trials):
+        text = ''.join(randomiser.choice("ACGT" if trial % 2 else "ACGTN") for x in range(randomiser.randint(1, max_length)))
+        expected = sorted(range(len(text)), key=lambda x: text[x:])
+        assert list(suffix_array(text.encode("ascii"))) == expected, "Wrong suffix order for {0!r}.".format(text)
+        pattern = text[randomiser.randrange(len(text)):][:randomiser.randint(1, 3)].replace("N", "A")
+        hits = set()
+        for strand, strand_text in ((1, text), (-1, nucutils.get_complement(text))):
+            for start in range(len(text) - len(pattern) + 1):
+                if strand_text[start:start+len(pattern)] == pattern:
+                    hits.add((start, start+len(pattern), 1) if strand == 1 else (len(text)-start-len(pattern), len(text)-start, -1))
+        found = SuffixIndex(text).find_all(pattern)
+        assert set(found) == hits, "Wrong hits for {0!r} in {1!r}.".format(pattern, text)
+    print("suffix_array and find_all agree with naive searches of {0} sequences.".format(trials))
+
+if __name__ == "__main__":
+    tests()
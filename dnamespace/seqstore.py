@@ -0,0 +1,364 @@
+'''seqstore - Compact storage backends for genome sequences.
+by Cathal Garvey
+Part of the DNAmespace project. License accessible as seqstore.license.
+
+The stores here stand in for the plain string normally stored as
+GenbankFile['Sequence']. They keep the string-like slicing interface that
+GBFeature and GBReference rely on (sequence[x:y] returns a str), so they
+can be swapped in without changes elsewhere. SeqView is a lazy window onto
+any of these, or onto a str or bytes, that copies nothing until it is used.
+SequenceCache holds resolved feature sequences within a size budget.
+'''
+from dnamespace import nucutils
+from dnamespace.gnulicenses import Affero as license
+import array
+import bisect
+import collections
+import itertools
+import mmap
+import re
+import threading
+import weakref
+
+# Canonical bases in packing order; a packed byte holds four of these,
+# first base in the most significant bits.
+packed_bases = "ACGT"
+# Every byte value rendered as its four bases. This follows from the order
+# itertools.product walks through the bases, i.e. "AAAA", "AAAC", ...
+_byte_to_bases = [''.join(x) for x in itertools.product(packed_bases, repeat=4)]
+# Translates bases to their 2-bit codes, one per byte:
+_base_codes = bytes.maketrans(packed_bases.encode(), bytes(range(4)))
+_unpackable = re.compile(r'[^ACGT]')
+_unpackable_run = re.compile(r'([^ACGT])\1*')
+
+class _StoredSequence:
+    '''Common str-like interface for the sequence stores below.
+    Subclasses define __len__ and _decode(start, stop), which returns the
+    bases from start to stop as a str for 0 <= start <= stop <= len(self).'''
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return self._decode(start, max(start, stop))
+            # Decode the covered range once, then let str handle the step.
+            if step > 0:
+                return self._decode(start, max(start, stop))[::step]
+            return self._decode(stop+1, max(stop+1, start+1))[::-1][::-step]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("{0} index out of range".format(type(self).__name__))
+        return self._decode(index, index+1)
+
+    def __str__(self):
+        return self._decode(0, len(self))
+
+    def __repr__(self):
+        return "<{0}: {1} bases>".format(type(self).__name__, len(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (str, _StoredSequence)):
+            return len(self) == len(other) and str(self) == str(other)
+        return NotImplemented
+
+    __hash__ = None
+
+class PackedSequence(_StoredSequence):
+    '''Read-only genome sequence stored at 2 bits per base.
+    A, C, G and T are packed four to a byte. Anything else (IUPAC ambiguity
+    codes, runs of N) is recorded in a sparse exception table of runs and
+    patched back in when a slice is read, so the round trip is exact.
+    Slicing and indexing return plain strings, as they would on a str.'''
+    def __init__(self, sequence):
+        sequence = str(sequence)
+        self._length = len(sequence)
+        # Exception table: parallel arrays of run starts, run ends and the
+        # single character repeated over each run, in sequence order.
+        self._exception_starts = array.array('l')
+        self._exception_ends = array.array('l')
+        exception_chars = []
+        for run in _unpackable_run.finditer(sequence):
+            self._exception_starts.append(run.start())
+            self._exception_ends.append(run.end())
+            exception_chars.append(run.group(1))
+        self._exception_chars = ''.join(exception_chars)
+        if exception_chars:
+            # Placeholders only; the real characters come from the table.
+            sequence = _unpackable.sub("A", sequence)
+        # Pad to a whole number of bytes; the padding is never read back.
+        sequence += "A" * (-len(sequence) % 4)
+        codes = sequence.encode("ascii").translate(_base_codes)
+        # Read every fourth code as one big integer, so each byte "lane"
+        # holds a single code (0-3). Shifting a whole lane integer shifts
+        # every code within its own byte without carrying into the next,
+        # so four shifted lanes summed give all the packed bytes at once.
+        lanes = [int.from_bytes(codes[offset::4], "big") for offset in range(4)]
+        packed = (lanes[0] << 6) + (lanes[1] << 4) + (lanes[2] << 2) + lanes[3]
+        self._packed = packed.to_bytes(len(codes)//4, "big")
+
+    def __len__(self):
+        return self._length
+
+    def _decode(self, start, stop):
+        if start >= stop:
+            return ''
+        first_byte = start // 4
+        bases = ''.join(map(_byte_to_bases.__getitem__, self._packed[first_byte:(stop+3)//4]))
+        bases = bases[start-first_byte*4:stop-first_byte*4]
+        # Find the first exception run ending after start, then patch in
+        # every run that begins before stop.
+        run = bisect.bisect_right(self._exception_ends, start)
+        if run < len(self._exception_starts) and self._exception_starts[run] < stop:
+            pieces = []
+            position = start
+            while run < len(self._exception_starts) and self._exception_starts[run] < stop:
+                run_start = max(self._exception_starts[run], start)
+                run_end = min(self._exception_ends[run], stop)
+                pieces.append(bases[position-start:run_start-start])
+                pieces.append(self._exception_chars[run] * (run_end-run_start))
+                position = run_end
+                run += 1
+            pieces.append(bases[position-start:])
+            bases = ''.join(pieces)
+        return bases
+
+class MappedSequence(_StoredSequence):
+    '''Genome sequence read on demand from a memory-mapped genbank file.
+    Should be given the mmap of the file and the byte offset of the first
+    line after "ORIGIN". Opening only indexes the byte offset and first
+    base of every ORIGIN line; a slice reads and cleans just the lines it
+    touches, so the full sequence is never built in memory.'''
+    def __init__(self, genbank_map, origin_offset):
+        self._map = genbank_map
+        # Byte offset of each sequence line, plus a closing offset, and the
+        # (0-based) position of the first base on each line, plus the length:
+        self._line_offsets = array.array('q')
+        self._line_starts = array.array('q')
+        bases_so_far = 0
+        genbank_map.seek(origin_offset)
+        for line in iter(genbank_map.readline, b""):
+            if line.startswith(b"//"):
+                break
+            bases = len(line.translate(None, nucutils.origin_noise))
+            if bases:
+                self._line_offsets.append(genbank_map.tell() - len(line))
+                self._line_starts.append(bases_so_far)
+                bases_so_far += bases
+        self._line_offsets.append(genbank_map.tell())
+        self._line_starts.append(bases_so_far)
+        self._length = bases_so_far
+
+    def __len__(self):
+        return self._length
+
+    def _decode(self, start, stop):
+        if start >= stop:
+            return ''
+        first_line = bisect.bisect_right(self._line_starts, start) - 1
+        last_line = bisect.bisect_left(self._line_starts, stop)
+        bases = nucutils.origin_to_bases(self._map[self._line_offsets[first_line]:self._line_offsets[last_line]])
+        offset = self._line_starts[first_line]
+        return bases[start-offset:stop-offset]
+
+    def __reduce__(self):
+        # A memory map can't be pickled, so pickles get a packed copy.
+        return (PackedSequence, (str(self),))
+
+class SeqView:
+    '''A lazy window onto part of a parent sequence.
+    A view holds only its parent, its bounds and its strand. Bases are copied
+    out when it is materialised with str() or bytes(), and a minus-strand
+    view is reverse-complemented only at that point. Any sliceable parent
+    (a str, PackedSequence or MappedSequence) is sliced when the view is
+    materialised. Only a bytes-like parent (bytes, bytearray, mmap) is read
+    through a memoryview of its buffer, and so can be viewed without a copy.
+    Genomes are never held as bytes, so the views that GBFeature and
+    GBReference give out are lazy but not zero-copy.
+    Slicing a view with a step of 1 gives another view, so windows can be
+    narrowed repeatedly without copying anything.'''
+    def __init__(self, parent, start=0, end=None, strand=1):
+        if end is None:
+            end = len(parent)
+        self._parent = parent
+        self.start = start
+        self.end = max(start, end)
+        self.strand = -1 if strand < 0 else 1
+        if isinstance(parent, (bytes, bytearray, mmap.mmap)):
+            self._buffer = memoryview(parent)
+        else:
+            self._buffer = None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _forward_bytes(self):
+        'Returns the viewed bases as they lie on the forward strand, as bytes or a memoryview.'
+        if self._buffer is not None:
+            return self._buffer[self.start:self.end]
+        return self._parent[self.start:self.end].encode("ascii")
+
+    def memoryview(self):
+        '''Returns the view's bases as a memoryview.
+        Only a forward view of a bytes-like parent points straight into the
+        parent's buffer. Any other view, including every view of a genome's
+        sequence, materialises a copy of its bases first.'''
+        if self.strand > 0:
+            return memoryview(self._forward_bytes())
+        return memoryview(bytes(self))
+
+    def __bytes__(self):
+        return str(self).encode("ascii")
+
+    def __str__(self):
+        if self._buffer is not None:
+            bases = bytes(self._buffer[self.start:self.end]).decode("ascii")
+        else:
+            bases = str(self._parent[self.start:self.end])
+        if self.strand < 0:
+            bases = nucutils.get_complement(bases)
+        return bases
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return str(self)[index]
+            stop = max(start, stop)
+            if self.strand > 0:
+                return SeqView(self._parent, self.start+start, self.start+stop, 1)
+            # Positions in a minus-strand view count back from its end.
+            return SeqView(self._parent, self.end-stop, self.end-start, -1)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("SeqView index out of range")
+        return str(self[index:index+1])
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def reverse_complement(self):
+        'Returns a view of the same bases on the opposite strand, without copying.'
+        return SeqView(self._parent, self.start, self.end, -self.strand)
+
+    def __repr__(self):
+        return "<SeqView: {0}..{1} ({2}) of {3} bases>".format(
+            self.start, self.end, "+" if self.strand > 0 else "-", len(self._parent))
+
+    def __eq__(self, other):
+        if isinstance(other, (str, SeqView, _StoredSequence)):
+            return len(self) == len(other) and str(self) == str(other)
+        return NotImplemented
+
+    __hash__ = None
+
+class SequenceCache:
+    '''Least-recently-used cache of resolved sequences, bounded by total size.
+    Maps keys to sequence strings. Once the cached sequences add up to more
+    than budget bases, which for ASCII strings is also bytes, the least
+    recently used are evicted; a budget of None never evicts. One cache can
+    be shared by any number of genomes. hits, misses and evictions count
+    lookups and evictions since the cache was made or last cleared, to help
+    size the budget.
+    GenbankFile keys each feature's sequence with key(genome, feature),
+    which holds neither object, so cached sequences never keep a genome
+    alive; a genome's entries are dropped once it has been collected.'''
+    def __init__(self, budget=64 << 20):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # ids of owners given to key() and still alive, and those collected
+        # since the last purge. Finalizers only append to the latter, as they
+        # can run inside a locked method of this cache.
+        self._owners = set()
+        self._dead_owners = []
+
+    def __len__(self):
+        with self._lock:
+            self._purge()
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._purge()
+            return key in self._entries
+
+    def __repr__(self):
+        return "<SequenceCache: {0} sequences, {1} of {2} bases>".format(
+            len(self), self.size, "unlimited" if self.budget is None else self.budget)
+
+    def key(self, owner, item):
+        '''Returns the key for item of owner (a feature of a genome, say).
+        The key is made of the two ids, so it keeps neither alive, and every
+        entry under owner is dropped once owner is garbage collected. owner
+        must support weak references and keep item alive while it lives.'''
+        with self._lock:
+            self._purge()
+            if id(owner) not in self._owners:
+                self._owners.add(id(owner))
+                weakref.finalize(owner, self._dead_owners.append, id(owner))
+        return (id(owner), id(item))
+
+    def _purge(self):
+        'Drops the entries of collected owners; call with the lock held.'
+        if not self._dead_owners:
+            return
+        dead = set()
+        while self._dead_owners:
+            dead.add(self._dead_owners.pop())
+        self._owners -= dead
+        for key in [x for x in self._entries if isinstance(x, tuple) and x[0] in dead]:
+            self.size -= len(self._entries.pop(key))
+
+    def get(self, key):
+        'Returns the sequence cached for key, or None, and marks it as recently used.'
+        with self._lock:
+            self._purge()
+            sequence = self._entries.get(key)
+            if sequence is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return sequence
+
+    def put(self, key, sequence):
+        '''Caches sequence for key, evicting the least recently used to stay in budget.
+        A sequence larger than the whole budget isn't cached.'''
+        with self._lock:
+            self._purge()
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            if self.budget is not None and len(sequence) > self.budget:
+                return
+            self._entries[key] = sequence
+            self.size += len(sequence)
+            while self.budget is not None and self.size > self.budget:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        'Empties the cache and resets its counters.'
+        with self._lock:
+            self._entries.clear()
+            self.size = self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        'Returns the counters, size and budget as a dict.'
+        with self._lock:
+            self._purge()
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "sequences": len(self), "size": self.size, "budget": self.budget}
+
+    def __getstate__(self):
+        # Pickles (such as gbcache snapshots) carry only the settings: cached
+        # sequences are cheap to resolve again, and locks can't be pickled.
+        return {"budget": self.budget}
+
+    def __setstate__(self, state):
+        self.__init__(state["budget"])
@@ -7,6 +7,10 @@ Designed as part of the DNAmespace project.
 import keyword
 from dnamespace.gnulicenses import Affero as license
 
+def _reserved_names(cls):
+    'Returns the methods and attributes of an nsdict class, which keys must not shadow.'
+    return frozenset(dir(cls)) | {"_method_keywords"}
+
 class nsdict(object):
     '''Mimics a dict but has no exposed methods, and exposes all keys as attributes.
     This allows use of this object as a "Virtual Namespace" with a dict-like interface.
@@ -25,8 +29,7 @@ class nsdict(object):
     them from attribute listing and autocompletion in iPython etc.
 
     For example, this object provides a "_keys()" attribute, which returns
-    a list of keys (an actual list and not a dict_keys, due to kludges),
-    and a pop method, which works as normal.
+    a dict_keys view of the keys, and a pop method, which works as normal.
 
     In most cases, these underscored dict methods are simply passed with
     all arguments to the object's underlying __dict__ attribute.
@@ -35,17 +38,23 @@ class nsdict(object):
     is that it cannot be directly passed to another dict's "update" method, as
     its equivalent of self.keys() is obfuscated. Instead, a compatibility method
     is added: self._asupdate(), which returns a normal dict containing all
-    significant key:value pairs from self.__dict__ (that is, those that are not
-    in self._method_keywords).'''
+    key:value pairs from self.__dict__.
+
+    The names that keys must not take, self._method_keywords, are worked out
+    once per class (subclass methods included) as a frozenset, rather than
+    listed anew for every instance. Instances keep their settings in slots,
+    and every way of adding keys goes through __setitem__, so __dict__ holds
+    only namespace items and _keys, _items and _values are direct views.'''
+    __slots__ = ("__dict__", "_autofix")
+
+    def __init_subclass__(cls, **nargs):
+        super().__init_subclass__(**nargs)
+        cls._method_keywords = _reserved_names(cls)
 
     def __init__(self, somedict=None, autofix=False):
         '''If autofix is set to true, then conflicting keywords are
         automatically suffixed with underscores until they no longer conflict.'''
         self._autofix = bool(autofix)
-        # Need a list of methods so we can rename keys that conflict.
-        # Keep this call second last in __init__, right before dict import.
-        self._method_keywords = dir(self)
-        self._method_keywords.append("_method_keywords")
         # If provided with a dict, then use self._update to import it.
         if somedict:
             # Could be strict on type input, but that would prevent
@@ -56,7 +65,7 @@ class nsdict(object):
 
     def __test_conflict__(self, key):
         'Tests a new key for conflict with reserved keywords or required object methods/attributes.'
-        return (key in keyword.kwlist) or (key in self._method_keywords)
+        return keyword.iskeyword(key) or (key in self._method_keywords)
 
     def __setitem__(self, key, value):
         'Set properties for all new dict keys. Reserved words are suffixed with "_".'
@@ -86,7 +95,7 @@ class nsdict(object):
         return self.__dict__.copy()
 
     def _fromkeys(self, *args, **nargs):
-        return self.__dict__(*args, **nargs)
+        return self.__dict__.fromkeys(*args, **nargs)
 
     def _get(self, *args, **nargs):
         return self.__dict__.get(*args, **nargs)
@@ -95,17 +104,7 @@ class nsdict(object):
         return self.__dict__.items()
 
     def _keys(self):
-        'Technically this returns a list, not a dict_keys object.'
-        keys = list(self.__dict__.keys())
-        for item in self._method_keywords:
-            try:
-                del(keys[keys.index(item)])
-            except ValueError: # When something isn't in the list.
-                pass
-        return keys
-
-    def _mro(self):
-        return self.__dict__.mro()
+        return self.__dict__.keys()
 
     def _pop(self, *args, **nargs):
         return self.__dict__.pop(*args, **nargs)
@@ -113,26 +112,26 @@ class nsdict(object):
     def _popitem(self, *args, **nargs):
         return self.__dict__.popitem(*args, **nargs)
 
-    def _setdefault(self, *args, **nargs):
-        return self.__dict__.pop(*args, **nargs)
+    def _setdefault(self, key, default=None):
+        if key not in self.__dict__:
+            self[key] = default
+        # Conflicting keys may have been stored under a suffixed name.
+        return self.__dict__.get(key, default)
 
     def _update(self, *args, **nargs):
         # nsdicts can be updated with other dicts as normal. However, to
         # perform the reverse operation, use dict.update(nsdict._asupdate()).
-        return self.__dict__.update(*args, **nargs)
+        # Keys go through __setitem__ so reserved names are fixed or refused.
+        for key, value in dict(*args, **nargs).items():
+            self[key] = value
 
     def _values(self):
         return self.__dict__.values()
 
     def _asupdate(self):
         '''Allows passing of an nsdict object to the update method of a normal
-        dict, by returning a redacted copy of the nsdict's __dict__ attribute,
-        removing any key/value pairs that match the self._method_keywords list.'''
-        compatible_dict = self._copy()
-        # Clear out methods and attribute names, spare only namespace items.
-        for key in self._method_keywords:
-            try:
-                del(compatible_dict[key])
-            except KeyError:
-                pass
-        return compatible_dict
+        dict, by returning a copy of the nsdict's __dict__ attribute, which
+        holds only namespace items.'''
+        return self._copy()
+
+nsdict._method_keywords = _reserved_names(nsdict)